@@ -1,21 +1,33 @@
 import os
+import json
 import logging
-from typing import Optional
+import asyncio
+import concurrent.futures
+from typing import Callable, List, Optional
 from datetime import date
+from functools import partial
+from operator import attrgetter, itemgetter
 
 from fastapi import Response, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import fastapi
+import pydantic
 import views_schema as schema
 import aiohttp
-import requests
 
+from . import cache
 from . import crud
+from . import definitions
 from . import models
+from . import pending
+from . import plans
 from . import db
 from . import remotes
+from . import serialization
 from . import settings
 from . import data_retriever
+from . import warmup
+from .selection import Selection
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +38,109 @@ except AttributeError:
 
 app = fastapi.FastAPI()
 
+@app.on_event("startup")
+async def open_http_session():
+    """
+    Opens a single, pooled HTTP session that is shared by all requests to the
+    data service for the lifetime of the worker, and the pools in which data
+    is decoded, merged and serialized, off the event loop.
+    """
+    app.state.pending = pending.PendingTracker()
+    app.state.relays = {}
+    app.state.db_executor = concurrent.futures.ThreadPoolExecutor(
+            settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW, thread_name_prefix = "db")
+    app.state.executor = concurrent.futures.ThreadPoolExecutor(settings.WORKER_THREADS)
+    decode_processes = max(settings.DECODE_PROCESSES, 0)
+    app.state.decode_executor = (
+            concurrent.futures.ProcessPoolExecutor(decode_processes)
+            if decode_processes > 0 else None)
+    connector = aiohttp.TCPConnector(
+            limit             = settings.HTTP_POOL_SIZE,
+            keepalive_timeout = settings.HTTP_KEEPALIVE_TIMEOUT,
+        )
+    app.state.http = aiohttp.ClientSession(
+            connector = connector,
+            timeout   = aiohttp.ClientTimeout(total = settings.HTTP_TIMEOUT),
+        )
+    app.state.retriever = data_retriever.DataRetriever(
+            settings.DATA_SERVICE_URL, app.state.http,
+            column_cache       = cache.columns,
+            result_cache       = cache.results,
+            concurrency        = settings.RETRIEVER_CONCURRENCY,
+            max_concurrency    = settings.RETRIEVER_MAX_CONCURRENCY,
+            merge_engine       = settings.MERGE_ENGINE,
+            pipeline           = settings.DATA_PIPELINE,
+            executor           = app.state.executor,
+            decode_executor    = app.state.decode_executor,
+            decode_concurrency = decode_processes or settings.WORKER_THREADS,
+            pending            = app.state.pending)
+    app.state.warmer = warmup.Warmer(
+            app.state.retriever, db.Session,
+            concurrency  = settings.WARMUP_CONCURRENCY,
+            assemble     = settings.DATA_ASSEMBLY == "local",
+            db_executor  = app.state.db_executor,
+            fetch_result = fetch_result if settings.DATA_ASSEMBLY != "local" else None)
+    app.state.warmup_schedule = (
+            asyncio.ensure_future(scheduled_warmup(settings.WARMUP_THEMES))
+            if settings.WARMUP_THEMES else None)
+    app.state.definition_listener = None
+    if settings.QUERYSET_CACHE_NOTIFY:
+        app.state.definition_listener = definitions.Listener(definitions.querysets, db.get_con)
+        app.state.definition_listener.start()
+
+@app.on_event("shutdown")
+async def close_http_session():
+    if app.state.warmup_schedule is not None:
+        app.state.warmup_schedule.cancel()
+    if app.state.definition_listener is not None:
+        app.state.definition_listener.stop()
+    await app.state.warmer.close()
+    await app.state.pending.close()
+    await app.state.http.close()
+    app.state.executor.shutdown(wait = False)
+    app.state.db_executor.shutdown(wait = False)
+    if app.state.decode_executor is not None:
+        app.state.decode_executor.shutdown(wait = False)
+
+async def scheduled_warmup(themes):
+    """
+    Warms the querysets of the given themes every WARMUP_INTERVAL seconds.
+    Failed runs are logged, and retried at the next interval.
+    """
+    def theme_querysets(session):
+        return [name for theme in themes for name in (crud.get_theme(session, theme) or {"querysets": []})["querysets"]]
+
+    while True:
+        try:
+            session = db.Session()
+            try:
+                names = await in_db(theme_querysets, session)
+            finally:
+                session.close()
+            run = app.state.warmer.start("schedule/" + ",".join(themes), names)
+            await app.state.warmer.wait(run)
+        except Exception:
+            logger.exception("Scheduled warmup of %s failed", ",".join(themes))
+        await asyncio.sleep(settings.WARMUP_INTERVAL)
+
+async def in_db(function, *args):
+    """
+    Runs blocking database work in a thread pool of its own, sized to the
+    connection pool, so that it neither blocks the event loop nor takes up
+    threads needed for other work.
+    """
+    return await asyncio.get_running_loop().run_in_executor(app.state.db_executor, function, *args)
+
+async def get_queryset_plan(session, name: str) -> Optional[plans.QuerysetPlan]:
+    """
+    Gets the plan of a queryset from the definition cache, only going to the
+    database (in the database thread pool) if it is not cached.
+    """
+    queryset = definitions.querysets.cached(name)
+    if queryset is None:
+        queryset = await in_db(crud.get_queryset_plan, session, name)
+    return queryset
+
 def hyperlink(r:fastapi.Request,*rest):
     url = r.url
     base = f"{url.scheme}://{url.hostname}:{url.port}"
@@ -38,31 +153,129 @@ def get_session():
     finally:
         sess.close()
 
-def get_queryset_dict(queryset):
-    full_qs_dict = queryset.dict()
-
-    qs_dict = {}
-    qs_dict['name'] = full_qs_dict['name']
-    qs_dict['to_loa'] = full_qs_dict['loa']
-    qs_paths = []
-    operations = full_qs_dict['operations']
-    for operation_path in operations:
-        path = ''
-        for operation in operation_path:
-            path = path + '/' + operation['namespace']
-            path = path + '/' + operation['name']
-            args = operation['arguments']
-            if len(args) == 0:
-                path = path + '/_'
-            else:
-                path = path + '/'
-                for arg in args:
-                    path = path + arg + '__'
-                path = path[:-2]
-        qs_paths.append(path)
-    qs_dict['paths'] = qs_paths
-
-    return qs_dict
+def get_queryset_dict(queryset: plans.QuerysetPlan, columns = None):
+    return {
+            "name":   queryset.name,
+            "to_loa": queryset.loa,
+            "paths":  ["/" + path for path in queryset.chain_paths(columns)],
+        }
+
+def relay_headers(response: aiohttp.ClientResponse):
+    """
+    Headers that can be passed on from an upstream response. Content-Length is
+    only meaningful if the body is relayed exactly as it was sent, which is
+    not the case if aiohttp decompresses it.
+    """
+    headers = {}
+    if "Content-Type" in response.headers:
+        headers["Content-Type"] = response.headers["Content-Type"]
+    if "Content-Length" in response.headers and "Content-Encoding" not in response.headers:
+        headers["Content-Length"] = response.headers["Content-Length"]
+    return headers
+
+async def relay_body(response: aiohttp.ClientResponse, writer: Optional[cache.CacheWriter] = None):
+    """
+    Yields the body of an upstream response chunk by chunk, releasing the
+    connection back to the pool when done (or when the client disconnects).
+    If a cache writer is passed, the body is also written to the cache, and
+    committed only if it was relayed completely.
+    """
+    try:
+        async for chunk in response.content.iter_chunked(settings.STREAM_CHUNK_SIZE):
+            if writer is not None:
+                writer.write(chunk)
+            yield chunk
+        if writer is not None:
+            writer.commit()
+    finally:
+        if writer is not None:
+            writer.abort()
+        response.release()
+
+class RelayResponse(StreamingResponse):
+    """
+    Streams the body of an upstream response with relay_body. The upstream
+    response is released, and the cache writer aborted unless committed,
+    when the response closes, even if its body was never iterated (for
+    instance if the client went away before it started). on_close is called
+    after that.
+    """
+    def __init__(self,
+            response: aiohttp.ClientResponse,
+            writer: Optional[cache.CacheWriter] = None,
+            on_close: Optional[Callable[[], None]] = None):
+        super().__init__(
+                relay_body(response, writer),
+                status_code = response.status,
+                headers     = relay_headers(response))
+        self.upstream = response
+        self.writer = writer
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            if self.writer is not None:
+                self.writer.abort()
+            self.upstream.release()
+            if self.on_close is not None:
+                self.on_close()
+
+async def store_data(response: aiohttp.ClientResponse, key: str, encoding, units, passthrough: bool) -> bytes:
+    """
+    Reads a successful upstream queryset response, transcodes it unless it
+    is passed through as is, and adds it to the result cache.
+    """
+    async with response:
+        content = await response.read()
+    if not passthrough:
+        content = await asyncio.get_running_loop().run_in_executor(
+                app.state.executor, serialization.transcode, content, encoding, units)
+    cache.results.put(key, content)
+    return content
+
+def job_state(request: fastapi.Request, job_id: str, job: pending.Job):
+    counts = app.state.pending.job_status(job)
+    if counts["pending"]:
+        status = "pending"
+    elif counts["failed"]:
+        status = "failed"
+    else:
+        status = "ready"
+    return {
+            "job_id":   job_id,
+            "queryset": job.queryset_name,
+            "status":   status,
+            **counts,
+            "data":     hyperlink(request, "data", job.queryset_name) + (f"?{job.query}" if job.query else ""),
+        }
+
+def job_response(request: fastapi.Request, queryset_name: str, keys) -> JSONResponse:
+    """
+    A 202 response pointing to a job that tracks the pending work.
+    """
+    job_id = app.state.pending.register(queryset_name, request.url.query, keys)
+    job = app.state.pending.job(job_id)
+    return JSONResponse(
+            job_state(request, job_id, job),
+            status_code = 202,
+            headers     = {"Location": hyperlink(request, "jobs", job_id)})
+
+def file_body(file):
+    """
+    Yields the contents of an open file chunk by chunk, closing it when done.
+    """
+    with file:
+        while chunk := file.read(settings.STREAM_CHUNK_SIZE):
+            yield chunk
+
+def cached_response(file, media_type: str) -> StreamingResponse:
+    return StreamingResponse(
+            file_body(file),
+            media_type = media_type,
+            headers    = {"Content-Length": str(os.fstat(file.fileno()).st_size)})
 
 @app.get("/")
 def handshake():
@@ -76,51 +289,365 @@ def handshake():
 @app.get("/data/{queryset_name}")
 async def queryset_data(
         queryset_name:str,
-        start_date = 0, end_date = 0,
+        request: fastapi.Request,
+        start_date: int = 0, end_date: int = 0,
+        format: Optional[str] = None,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        columns: Optional[str] = None,
+        units: Optional[str] = None,
+        wait: float = 0,
+        accept: Optional[str] = fastapi.Header(None),
         session = Depends(get_session)):
     """
     Retrieve data corresponding to a queryset
+
+    Data is returned as parquet by default. Arrow IPC streams and Feather
+    files can be requested with the format query parameter (arrow / feather),
+    or with the Accept header (application/vnd.apache.arrow.stream /
+    application/vnd.apache.arrow.file).
+
+    The compression codec can be chosen with the compression (and
+    compression_level) query parameters, or with parameters of the Accept
+    header, for instance "Accept: application/vnd.apache.parquet; compression=zstd; level=3".
+
+    A subset of the data can be requested with the columns and units query
+    parameters, as comma separated column names and unit ids. Operations for
+    columns that are not selected are not fetched at all.
+
+    If some of the data is pending upstream, it is polled in the background,
+    and the response is a 202 with a job (see /jobs/{job_id}), also linked to
+    in the Location header. Requests can instead wait for pending data for up
+    to wait seconds (max PENDING_MAX_WAIT).
+
+    Concurrent requests for the same data assembled upstream make a single
+    upstream request: the first one relays the data and adds it to the
+    cache, and the others wait for it to be cached, and serve it from there.
     """
+    wait = min(max(wait, 0), settings.PENDING_MAX_WAIT)
+
+    try:
+        encoding = serialization.negotiate(accept, format, compression, compression_level)
+        selected = Selection.parse(columns, units)
+    except ValueError as ve:
+        return Response(str(ve), status_code=400)
 
-    queryset = crud.get_queryset(session,queryset_name)
+    queryset = await get_queryset_plan(session, queryset_name)
 
     if queryset is None:
         return Response(status_code=404)
 
-    qs_dict = get_queryset_dict(queryset)
+    unknown = selected.unknown_columns(queryset)
+    if unknown:
+        return Response(f"Unknown columns: {', '.join(unknown)}", status_code=400)
+
+    passthrough = (
+            settings.DATA_ASSEMBLY != "local"
+            and encoding == serialization.Encoding()
+            and selected.units is None)
+    if not passthrough:
+        encoding = encoding.with_defaults()
+
+    key = cache.result_key(
+            queryset.fingerprint(), start_date, end_date, encoding.key, selected.key)
+    cached = cache.results.open(key)
+    if cached is not None:
+        logger.debug("Serving %s from cache", queryset_name)
+        return cached_response(cached, encoding.media_type)
+
+    if settings.DATA_ASSEMBLY == "local":
+        retrieve = partial(
+                app.state.retriever.queryset_data_response,
+                queryset, start_date, end_date, encoding, selected)
+        status_code, content = await retrieve()
+        if status_code == 202 and wait:
+            await app.state.pending.wait(app.state.retriever.pending_urls(queryset, selected), wait)
+            status_code, content = await retrieve()
+        if status_code == 202:
+            return job_response(request, queryset_name, app.state.retriever.pending_urls(queryset, selected))
+        return Response(
+                content,
+                status_code = status_code,
+                media_type  = encoding.media_type if status_code == 200 else None)
+
+    qs_dict = get_queryset_dict(queryset, selected.columns)
 
     logger.debug("dict %s", qs_dict)
 
-    url = f'{settings.DATA_SERVICE_URL}/queryset/{start_date}/{end_date}/'
+    url = remote_url(start_date, end_date)
+    poll = partial(poll_result, url, qs_dict, key, encoding, selected.units, passthrough)
 
-    response = requests.get(url, json=qs_dict)
+    cached = await relayed(key)
+    if cached is not None:
+        return cached_response(cached, encoding.media_type)
 
-    content = response.content
-    status_code = response.status_code
+    finish = start_relay(key)
+    streaming = False
+    try:
+        if not app.state.pending.pending(key):
+            response = await app.state.http.get(url, json=qs_dict)
+            if response.status == 202:
+                response.release()
+                app.state.pending.watch(key, poll)
+
+        if app.state.pending.pending(key):
+            finish()
+            await app.state.pending.wait([key], wait)
+            cached = cache.results.open(key)
+            if cached is not None:
+                return cached_response(cached, encoding.media_type)
+            if app.state.pending.pending(key):
+                return job_response(request, queryset_name, [key])
+            response = await app.state.http.get(url, json=qs_dict)
+
+        if response.status != 200 or not (passthrough and settings.DATA_STREAMING):
+            if response.status != 200:
+                async with response:
+                    return Response(await response.read(), status_code=response.status)
+            content = await store_data(response, key, encoding, selected.units, passthrough)
+            return Response(content, media_type=encoding.media_type)
+
+        streaming = True
+        return RelayResponse(response, cache.results.writer(key), on_close = finish)
+    finally:
+        if not streaming:
+            finish()
+
+def start_relay(key: str) -> Callable[[], None]:
+    """
+    Marks a result as being fetched from upstream, so that concurrent
+    requests for it wait for it (see relayed) instead of requesting it
+    again. Returns the function to call once the result is in the result
+    cache, or has failed to get there.
+    """
+    finished = asyncio.Event()
+    app.state.relays[key] = finished
+
+    def finish():
+        if app.state.relays.get(key) is finished:
+            del app.state.relays[key]
+        finished.set()
+    return finish
+
+async def relayed(key: str):
+    """
+    Waits for a request fetching the same result from upstream, if there is
+    one, and returns the result from the result cache if that request put it
+    there. Returns None otherwise, in which case the result should be
+    requested again.
+    """
+    finished = app.state.relays.get(key)
+    if finished is None:
+        return None
+    try:
+        await asyncio.wait_for(finished.wait(), settings.HTTP_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    return cache.results.open(key)
 
-    return Response(content, status_code=status_code)
+def remote_url(start_date: int, end_date: int) -> str:
+    return f'{settings.DATA_SERVICE_URL}/queryset/{start_date}/{end_date}/'
+
+async def poll_result(url: str, qs_dict, key: str, encoding, units, passthrough: bool) -> int:
+    """
+    Requests a queryset result from upstream, adding it to the result cache
+    if it is ready. Returns the status code of the response.
+    """
+    response = await app.state.http.get(url, json=qs_dict)
+    if response.status == 200:
+        await store_data(response, key, encoding, units, passthrough)
+    else:
+        response.release()
+    return response.status
+
+async def fetch_result(queryset: plans.QuerysetPlan) -> int:
+    """
+    Fetches the default result of a queryset (all columns and time, in the
+    default encoding) from upstream into the result cache, under the key
+    that /data/{queryset_name} looks it up by. Results that are pending
+    upstream are polled in the background. Used for warming querysets that
+    are assembled upstream.
+    """
+    encoding, selected = serialization.Encoding(), Selection()
+    key = cache.result_key(queryset.fingerprint(), 0, 0, encoding.key, selected.key)
+    cached = cache.results.open(key) or await relayed(key)
+    if cached is not None:
+        cached.close()
+        return 200
+    if app.state.pending.pending(key):
+        return 202
+
+    poll = partial(poll_result, remote_url(0, 0), get_queryset_dict(queryset), key, encoding, None, True)
+    finish = start_relay(key)
+    try:
+        status_code = await poll()
+        if status_code == 202:
+            app.state.pending.watch(key, poll)
+    finally:
+        finish()
+    return status_code
+
+@app.get("/jobs/{job_id}")
+def job_detail(job_id: str, request: fastapi.Request):
+    """
+    Get the state of a job created for a request for pending data: pending,
+    failed or ready, with the number of pending, ready and failed resources,
+    and a link to the data.
+    """
+    job = app.state.pending.job(job_id)
+    if job is None:
+        return Response(status_code=404)
+    return JSONResponse(job_state(request, job_id, job))
+
+def warmup_response(request: fastapi.Request, run: warmup.WarmupRun) -> JSONResponse:
+    return JSONResponse(
+            run.state(),
+            status_code = 202,
+            headers     = {"Location": hyperlink(request, "warmup", run.run_id)})
+
+@app.post("/warmup/themes/{theme}")
+async def warmup_theme(theme: str, request: fastapi.Request, session = Depends(get_session)):
+    """
+    Starts fetching the data of all querysets of a theme into the caches.
+    Progress is reported by /warmup/{run_id}.
+    """
+    found = await in_db(crud.get_theme, session, theme)
+    if found is None:
+        return fastapi.Response("No such theme",status_code=404)
+    run = app.state.warmer.start(f"theme/{theme}", found["querysets"])
+    return warmup_response(request, run)
+
+@app.post("/warmup/querysets/{queryset}")
+async def warmup_queryset(queryset: str, request: fastapi.Request, session = Depends(get_session)):
+    """
+    Starts fetching the data of a queryset into the caches. Progress is
+    reported by /warmup/{run_id}.
+    """
+    if await get_queryset_plan(session, queryset) is None:
+        return fastapi.Response(status_code=404)
+    run = app.state.warmer.start(f"queryset/{queryset}", [queryset])
+    return warmup_response(request, run)
+
+@app.get("/warmup")
+def warmup_list():
+    """
+    Lists the warm-up runs of this worker, and their progress.
+    """
+    return JSONResponse({
+            "runs": [run.state() for run in app.state.warmer.runs()]
+        })
+
+@app.get("/warmup/{run_id}")
+def warmup_detail(run_id: str):
+    """
+    Reports the progress of a warm-up run: the status of each of its
+    querysets (queued, warming, warm, pending, failed or missing).
+    """
+    run = app.state.warmer.run(run_id)
+    if run is None:
+        return Response(status_code=404)
+    return JSONResponse(run.state())
+
+@app.get("/cache")
+def cache_stats():
+    """
+    Returns hit / miss counts (for this worker) and sizes of the data caches,
+    and of the cache of queryset definitions.
+    """
+    return JSONResponse({
+            "results":     cache.results.stats(),
+            "columns":     cache.columns.stats(),
+            "definitions": definitions.querysets.stats(),
+        })
 
 @app.get("/querysets/{queryset}")
-def queryset_detail(queryset:str, session = Depends(get_session)):
+async def queryset_detail(queryset:str, session = Depends(get_session)):
     """
     Get details about a queryset
     """
 
-    queryset = session.query(models.Queryset).get(queryset)
+    queryset = await get_queryset_plan(session, queryset)
     if queryset is None:
         return fastapi.Response(status_code=404)
     return queryset.dict()
 
-@app.get("/querysets")
-def queryset_list(session = Depends(get_session)):
+def read_page(list_page, after: Optional[str], limit: Optional[int]):
+    """
+    Reads a page of a listing with a session of its own, so that no
+    connection is held between pages.
+    """
+    session = db.Session()
+    try:
+        return list_page(session, after = after, limit = limit)
+    finally:
+        session.close()
+
+async def ndjson_listing(list_page, line, after: Optional[str], limit: Optional[int], cursor = attrgetter("name")):
+    """
+    Yields the rows of a listing as NDJSON, reading them a page of
+    LISTING_PAGE_SIZE rows at a time. The next page starts after the cursor
+    of the last row of the previous one.
     """
-    Lists all current querysets
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = settings.LISTING_PAGE_SIZE if remaining is None else min(remaining, settings.LISTING_PAGE_SIZE)
+        rows = await in_db(read_page, list_page, after, size)
+        for row in rows:
+            yield json.dumps(line(row)) + "\n"
+        if len(rows) < size:
+            break
+        after = cursor(rows[-1])
+        remaining = None if remaining is None else remaining - len(rows)
+
+async def listing(
+        list_page, key: str, line,
+        after: Optional[str], limit: Optional[int],
+        format: Optional[str], accept: Optional[str]) -> Response:
     """
-    querysets = session.query(models.Queryset).all()
+    A listing as JSON, with the names in a list under key, and the cursor of
+    the next page (if limit is set, and there are more rows) under "next",
+    or streamed as NDJSON, one row per line, if format is ndjson or the
+    Accept header asks for application/x-ndjson.
+    """
+    if format not in (None, "json", "ndjson"):
+        return Response(f"Unknown format \"{format}\", expected json or ndjson", status_code=400)
+
+    if format == "ndjson" or (format is None and (accept or "").startswith("application/x-ndjson")):
+        return StreamingResponse(
+                ndjson_listing(list_page, line, after, limit),
+                media_type = "application/x-ndjson")
 
+    rows = await in_db(read_page, list_page, after, None if limit is None else limit + 1)
+    more = limit is not None and len(rows) > limit
+    rows = rows[:limit]
     return JSONResponse({
-                "querysets":[queryset.name for queryset in querysets]
-            })
+            key:    [row.name for row in rows],
+            "next": rows[-1].name if more else None,
+        })
+
+@app.get("/querysets")
+async def queryset_list(
+        prefix: Optional[str] = None,
+        loa: Optional[str] = None,
+        theme: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = fastapi.Query(None, ge = 1),
+        format: Optional[str] = None,
+        accept: Optional[str] = fastapi.Header(None)):
+    """
+    Lists current querysets, ordered by name
+
+    The listing can be filtered by name prefix, level of analysis (loa) and
+    theme. With limit, at most limit names are returned, along with a
+    cursor ("next") that can be passed as after to get the next page.
+
+    With format=ndjson (or Accept: application/x-ndjson) the listing is
+    streamed as one {"name": ..., "loa": ...} object per line.
+    """
+    return await listing(
+            partial(crud.list_querysets, prefix = prefix, loa = loa, theme = theme),
+            "querysets", lambda row: {"name": row.name, "loa": row.level_of_analysis_id},
+            after, limit, format, accept)
 
 @app.post("/querysets")
 def queryset_create(
@@ -165,12 +692,80 @@ def queryset_delete(queryset:str, session = Depends(get_session)):
     """
     Deletes the target queryset (does not delete any data)
     """
-    existing = session.query(models.Queryset).get(queryset)
-    if existing is not None:
-        session.delete(existing)
-        session.commit()
-        return fastapi.Response(status_code=204)
-    return fastapi.Response(status_code=404)
+    try:
+        crud.delete_queryset(session, queryset)
+    except crud.DoesNotExist:
+        return fastapi.Response(status_code=404)
+    return fastapi.Response(status_code=204)
+
+async def posted_querysets(request: fastapi.Request) -> List[schema.Queryset]:
+    """
+    Querysets posted as a JSON list, or as NDJSON (one queryset per line)
+    with Content-Type application/x-ndjson. Raises ValueError if the body
+    cannot be parsed.
+    """
+    body = await request.body()
+    if request.headers.get("Content-Type", "").startswith("application/x-ndjson"):
+        items = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        items = json.loads(body)
+    return pydantic.parse_obj_as(List[schema.Queryset], items)
+
+async def bulk_write(request: fastapi.Request, session, overwrite: bool) -> Response:
+    try:
+        posted = await posted_querysets(request)
+    except ValueError as ve:
+        return Response(str(ve), status_code=422)
+
+    try:
+        names = await in_db(crud.bulk_write_querysets, session, posted, overwrite)
+    except crud.Exists as exists:
+        return Response(f"{exists}, overwrite False", status_code=409)
+    except ValueError as ve:
+        return Response(str(ve), status_code=422)
+    return JSONResponse({
+            "querysets": names
+        })
+
+@app.post("/bulk/querysets")
+async def queryset_bulk_create(request: fastapi.Request, overwrite: bool = False, session = Depends(get_session)):
+    """
+    Creates many querysets in a single transaction: either all of them are
+    created, or none. The body is a JSON list of querysets, or NDJSON (one
+    queryset per line) with Content-Type application/x-ndjson. Fails with
+    409 if any of the querysets exist, unless overwrite is true.
+    """
+    return await bulk_write(request, session, overwrite)
+
+@app.put("/bulk/querysets")
+async def queryset_bulk_replace(request: fastapi.Request, session = Depends(get_session)):
+    """
+    Creates or replaces many querysets in a single transaction, see POST
+    /bulk/querysets.
+    """
+    return await bulk_write(request, session, True)
+
+@app.delete("/bulk/querysets")
+async def queryset_bulk_delete(names: List[str] = fastapi.Body(...), session = Depends(get_session)):
+    """
+    Deletes the querysets named in a JSON list, in a single transaction.
+    Returns the names of the querysets that existed.
+    """
+    deleted = await in_db(crud.bulk_delete_querysets, session, names)
+    return JSONResponse({
+            "querysets": deleted
+        })
+
+@app.get("/bulk/querysets")
+async def queryset_bulk_export():
+    """
+    Streams the definitions of all querysets as NDJSON, one queryset per
+    line, in the format accepted by POST /bulk/querysets. Querysets are read
+    a page of LISTING_PAGE_SIZE at a time, as for listings.
+    """
+    return StreamingResponse(
+            ndjson_listing(crud.export_querysets, lambda queryset: queryset, None, None, cursor = itemgetter("name")),
+            media_type = "application/x-ndjson")
 
 @app.patch("/themes/{theme_name}/{queryset_name}")
 def theme_associate_queryset(theme_name:str, queryset_name:str, session = Depends(get_session)):
@@ -182,27 +777,31 @@ def theme_associate_queryset(theme_name:str, queryset_name:str, session = Depend
     if queryset is None:
         return Response(f"No queryset named {queryset_name}", status_code=404)
     queryset.themes.append(theme)
-    session.commit()
+    crud.commit_written(session, queryset_name)
     return Response(f"{queryset_name} associated with {theme_name}")
 
 @app.get("/themes")
-def theme_list(session = Depends(get_session)):
-    themes = session.query(models.Theme).all()
-    return JSONResponse({
-            "querysets": [theme.name for theme in themes]
-        })
+async def theme_list(
+        prefix: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = fastapi.Query(None, ge = 1),
+        format: Optional[str] = None,
+        accept: Optional[str] = fastapi.Header(None)):
+    """
+    Lists themes, ordered by name, see /querysets for filtering by prefix,
+    pagination and NDJSON. NDJSON lines are {"name": ..., "description": ...}.
+    """
+    return await listing(
+            partial(crud.list_themes, prefix = prefix),
+            "querysets", lambda row: {"name": row.name, "description": row.description},
+            after, limit, format, accept)
 
 @app.get("/themes/{theme}")
-def theme_detail(theme:str, session = Depends(get_session)):
+async def theme_detail(theme:str, session = Depends(get_session)):
     """
     Returns a list of the querysets with associated with the requested theme.
     """
-    theme = session.query(models.Theme).get(theme)
-    if theme is None:
+    detail = await in_db(crud.get_theme, session, theme)
+    if detail is None:
         return fastapi.Response("No such theme",status_code=404)
-    return JSONResponse({
-            "name": theme.name,
-            "description": theme.description if theme.description is not None else "",
-
-            "querysets": [qs.name for qs in theme.querysets]
-        })
+    return JSONResponse(detail)
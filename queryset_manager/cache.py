@@ -0,0 +1,268 @@
+"""
+cache
+=====
+
+Exposes the DiskCache class, a size-bounded store of bytes on local disk with
+least-recently-used eviction, and the cache instances used by the app:
+
+* results: Assembled queryset data, keyed by queryset fingerprint and window.
+* columns: Upstream column data, keyed by (a digest of) the column URL.
+"""
+import os
+import time
+import hashlib
+import logging
+import tempfile
+from typing import IO, Any, Dict, Optional
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+class DiskCache():
+    """
+    DiskCache
+    =========
+
+    parameters:
+        directory (str): Where to keep cached entries. Created when needed.
+        max_size (int): Max total size of entries in bytes. 0 disables the cache.
+        ttl (Optional[float]): Max age of entries in seconds.
+
+    Each entry is a file named by its key. The modification time of the file
+    is the time it was written, and is used to expire entries, while the
+    access time is bumped explicitly on each read and is used to evict the
+    least recently used entries when the cache grows beyond max_size.
+
+    Keys are used as file names, and must be safe as such (hex digests are).
+
+    Hits and misses are counted per process.
+    """
+
+    TMP_PREFIX = ".tmp-"
+
+    def __init__(self, directory: str, max_size: int, ttl: Optional[float] = None):
+        self._directory = directory
+        self._max_size = max_size
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    def open(self, key: str) -> Optional[IO[bytes]]:
+        """
+        open
+        ====
+
+        parameters:
+            key (str)
+        returns:
+            Optional[IO[bytes]]: An open, binary file, or None if the key is not cached.
+
+        The returned file stays readable even if the entry is evicted while
+        it is being read.
+        """
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        written = os.fstat(file.fileno()).st_mtime
+        now = time.time()
+        if self._ttl is not None and now - written > self._ttl:
+            file.close()
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path, (now, written))
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return file
+
+    def get(self, key: str) -> Optional[bytes]:
+        file = self.open(key)
+        if file is None:
+            return None
+        with file:
+            return file.read()
+
+    def put(self, key: str, data: bytes) -> None:
+        with self.writer(key) as writer:
+            writer.write(data)
+
+    def writer(self, key: str) -> "CacheWriter":
+        """
+        writer
+        ======
+
+        parameters:
+            key (str)
+        returns:
+            CacheWriter
+
+        Returns a writer that can be used to add an entry incrementally. The
+        entry only becomes visible when the writer is committed, which
+        happens when it is used as a context manager and exits without an
+        exception.
+        """
+        return CacheWriter(self, key)
+
+    def invalidate(self, prefix: str) -> int:
+        """
+        invalidate
+        ==========
+
+        parameters:
+            prefix (str)
+        returns:
+            int: Number of removed entries
+
+        Removes all entries with keys starting with prefix.
+        """
+        removed = 0
+        for entry in self._entries():
+            if entry.name.startswith(prefix):
+                removed += self._remove(entry.path)
+        return removed
+
+    def evict(self) -> None:
+        """
+        Removes expired entries, and then the least recently used entries
+        until the cache fits within its max size.
+        """
+        now = time.time()
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if self._ttl is not None and now - stat.st_mtime > self._ttl:
+                self._remove(entry.path)
+            else:
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counts and sizes of entries. Entries removed by other requests or
+        workers while they are counted are skipped.
+        """
+        sizes = []
+        for entry in self._entries():
+            try:
+                sizes.append(entry.stat().st_size)
+            except FileNotFoundError:
+                continue
+        return {
+                "enabled": self.enabled,
+                "hits":    self.hits,
+                "misses":  self.misses,
+                "entries": len(sizes),
+                "size":    sum(sizes),
+            }
+
+    def _entries(self):
+        try:
+            with os.scandir(self._directory) as entries:
+                return [e for e in entries if e.is_file() and not e.name.startswith(self.TMP_PREFIX)]
+        except FileNotFoundError:
+            return []
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key)
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+class CacheWriter():
+    """
+    CacheWriter
+    ===========
+
+    Writes an entry to a temporary file, which replaces the entry when
+    committed. Does nothing if the cache is disabled.
+    """
+    def __init__(self, cache: DiskCache, key: str):
+        self._cache = cache
+        self._key = key
+        self._file = None
+
+        if cache.enabled:
+            os.makedirs(cache._directory, exist_ok = True)
+            self._file = tempfile.NamedTemporaryFile(
+                    dir = cache._directory, prefix = DiskCache.TMP_PREFIX, delete = False)
+
+    def write(self, data: bytes) -> None:
+        if self._file is not None:
+            self._file.write(data)
+
+    def commit(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._file.name, self._cache._path(self._key))
+        self._file = None
+        self._cache.evict()
+
+    def abort(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        DiskCache._remove(self._file.name)
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+def result_key(
+        fingerprint: str, start: Optional[int], end: Optional[int],
+        encoding: str, selection: str = "all") -> str:
+    """
+    Key for the result cache. Starts with the fingerprint of the queryset, so
+    that all results for a queryset can be invalidated together. The
+    selection and encoding tell apart subsets and differently serialized
+    versions of the same data.
+    """
+    return f"{fingerprint}-{start or 0}-{end or 0}-{selection}-{encoding}"
+
+def url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+results = DiskCache(
+        settings.RESULT_CACHE_DIR,
+        settings.RESULT_CACHE_SIZE,
+        settings.RESULT_CACHE_TTL)
+
+columns = DiskCache(
+        settings.COLUMN_CACHE_DIR,
+        settings.COLUMN_CACHE_SIZE,
+        settings.COLUMN_CACHE_TTL)
@@ -1,11 +1,18 @@
 
-from typing import TypeVar
+from typing import Any, Dict, Iterable, List, Optional, TypeVar
+from sqlalchemy import func, select, text
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload
 from toolz.functoolz import curry
 import views_schema
 
 from . import models
+from . import cache
+from . import definitions
+from . import plans
+from . import settings
+
+BULK_ROWS = 1000
 
 class Exists(Exception):
     pass
@@ -14,27 +21,420 @@ class DoesNotExist(Exception):
     pass
 
 def get_queryset(session:Session,name:str) -> models.Queryset:
-    return session.query(models.Queryset).get(name)
+    """
+    Gets a queryset with its whole definition loaded: its level of analysis,
+    themes and operation chains. The operations of all chains are loaded with
+    a single recursive query, and the chains are linked up in memory, so that
+    the queryset can be used without any further queries, also after the
+    session is closed.
+    """
+    queryset = (session.query(models.Queryset)
+            .options(
+                joinedload(models.Queryset.level_of_analysis),
+                selectinload(models.Queryset.themes),
+                selectinload(models.Queryset.operation_roots))
+            .get(name))
+
+    if queryset is not None:
+        # The session only holds weak references, so the operations must be
+        # kept alive until the chains (which then reference them) are walked.
+        operations = load_operations(session, name)
+        queryset.op_chains()
+        del operations
+    return queryset
+
+def get_queryset_plan(session:Session,name:str) -> Optional[plans.QuerysetPlan]:
+    """
+    Gets the plan of a queryset from the definition cache, loading the
+    queryset with get_queryset if it is not cached.
+    """
+    return definitions.querysets.get(name, lambda: get_queryset(session, name))
+
+def load_operations(session:Session,queryset_name:str) -> List[models.Operation]:
+    """
+    Loads all operations of the chains of a queryset into the session.
+    """
+    chain = chain_cte(session, [queryset_name])
+    return (session.query(models.Operation)
+            .join(chain, models.Operation.operation_id == chain.c.operation_id)
+            .all())
+
+def chain_cte(session:Session,queryset_names:Iterable[str]):
+    """
+    A recursive CTE of the ids of all operations of the chains of the named
+    querysets, found by following next_operation_id from their roots.
+    """
+    chain = (session.query(models.Operation.operation_id, models.Operation.next_operation_id)
+            .filter(models.Operation.queryset_name.in_(list(queryset_names)))
+            .cte("chain", recursive = True))
+    following = aliased(models.Operation)
+    return chain.union_all(
+            session.query(following.operation_id, following.next_operation_id)
+            .filter(following.operation_id == chain.c.next_operation_id))
 
 def create_queryset(session:Session, posted: views_schema.Queryset) -> models.Queryset:
     queryset = models.Queryset.from_pydantic(session, posted)
     session.add(queryset)
 
     try:
-        session.commit()
+        commit_written(session, queryset.name)
     except IntegrityError:
         raise Exists
 
+    cache.results.invalidate(queryset.fingerprint())
     return queryset
 
 def delete_queryset(session: Session, name: str) -> None:
     qs = session.query(models.Queryset).get(name)
     if qs is not None:
+        fingerprint = qs.fingerprint()
         session.delete(qs)
-        session.commit()
+        commit_written(session, name)
+        cache.results.invalidate(fingerprint)
     else:
         raise DoesNotExist(f"Queryset {name} does not exist")
 
+def commit_written(session: Session, *names: str) -> None:
+    """
+    Commits changes to the named querysets, and invalidates their cached
+    definitions, in this worker and, if QUERYSET_CACHE_NOTIFY is set, in
+    others (notifications are sent when the transaction commits).
+    """
+    if settings.QUERYSET_CACHE_NOTIFY and names:
+        session.execute(
+                text("SELECT pg_notify(:channel, name) FROM unnest(:names) AS name"),
+                {"channel": definitions.NOTIFY_CHANNEL, "names": list(names)})
+    session.commit()
+    for name in names:
+        definitions.querysets.invalidate(name)
+
+def bulk_write_querysets(
+        session: Session,
+        posted: List[views_schema.Queryset],
+        replace: bool = False) -> List[str]:
+    """
+    bulk_write_querysets
+    ====================
+
+    parameters:
+        session (sqlalchemy.orm.Session)
+        posted (List[views_schema.Queryset])
+        replace (bool): Whether to replace existing querysets
+    returns:
+        List[str]: Names of the written querysets
+
+    Creates (or replaces) many querysets in a single transaction, so that
+    either all of them are written, or none. Rows are inserted in bulk
+    rather than one by one, with the ids of operations allocated up front,
+    so that chains can be linked before they are inserted.
+
+    Raises Exists if any of the querysets exist and replace is False, or if
+    they are written by another transaction at the same time, and ValueError
+    if the querysets are not valid.
+    """
+    names = [qs.name for qs in posted]
+    if len(set(names)) != len(names):
+        raise ValueError("Querysets must have distinct names")
+
+    chains = {qs.name: [[operation_plan(op) for op in chain] for chain in qs.operations] for qs in posted}
+    for queryset_chains in chains.values():
+        for chain in queryset_chains:
+            validate_chain(chain)
+
+    try:
+        if replace:
+            replaced = delete_rows(session, names)
+        else:
+            replaced = {}
+            existing = [n for n, in session.query(models.Queryset.name).filter(models.Queryset.name.in_(names))]
+            if existing:
+                raise Exists(f"Querysets already exist: {', '.join(existing)}")
+
+        insert_missing_names(session, models.LevelOfAnalysis, {qs.loa for qs in posted})
+        insert_missing_names(session, models.Theme, {th for qs in posted for th in qs.themes})
+
+        insert_rows(session, models.Queryset.__table__, [
+                {"name": qs.name, "level_of_analysis_id": qs.loa, "description": qs.description}
+                for qs in posted])
+        insert_rows(session, models.querysets_themes, [
+                {"queryset_name": qs.name, "theme_name": th}
+                for qs in posted for th in dict.fromkeys(qs.themes)])
+        insert_rows(session, models.Operation.__table__, operation_rows(session, chains))
+
+        commit_written(session, *names)
+    except IntegrityError as ie:
+        session.rollback()
+        raise Exists(f"Querysets were written concurrently: {', '.join(names)}") from ie
+    except Exception:
+        session.rollback()
+        raise
+
+    for qs in posted:
+        cache.results.invalidate(models.definition_fingerprint(qs.loa, chains[qs.name]))
+    for fingerprint in replaced.values():
+        cache.results.invalidate(fingerprint)
+    return names
+
+def bulk_delete_querysets(session: Session, names: List[str]) -> List[str]:
+    """
+    Deletes many querysets in a single transaction, returning the names of
+    those that existed.
+    """
+    try:
+        deleted = delete_rows(session, names)
+        commit_written(session, *deleted)
+    except Exception:
+        session.rollback()
+        raise
+
+    for fingerprint in deleted.values():
+        cache.results.invalidate(fingerprint)
+    return list(deleted)
+
+def export_querysets(
+        session: Session,
+        after: Optional[str] = None,
+        limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    The definitions of querysets, ordered by name, in the format they are
+    posted in (see views_schema.Queryset), with one query per table. Like
+    list_querysets, after and limit select a page, so that all querysets can
+    be exported a page at a time.
+    """
+    table = models.Queryset.__table__
+    rows = session.execute(page(
+        select([table.c.name, table.c.level_of_analysis_id, table.c.description]),
+        table.c.name, None, after, limit)).fetchall()
+    names = [row.name for row in rows]
+    if not names:
+        return []
+
+    themes: Dict[str, List[str]] = {}
+    for queryset_name, theme_name in session.execute(
+            select([models.querysets_themes.c.queryset_name, models.querysets_themes.c.theme_name])
+            .where(models.querysets_themes.c.queryset_name.in_(names))):
+        themes.setdefault(queryset_name, []).append(theme_name)
+
+    chain = chain_cte(session, names)
+    chains = assemble_chains(session.execute(
+        select([models.Operation.__table__])
+        .where(models.Operation.operation_id.in_(select([chain.c.operation_id])))))
+
+    return [
+            {
+                "name":        name,
+                "loa":         loa,
+                "description": description,
+                "themes":      themes.get(name, []),
+                "operations":  [[op.dict() for op in chain] for chain in chains.get(name, [])],
+            }
+            for name, loa, description in rows
+        ]
+
+def delete_rows(session: Session, names: List[str]) -> Dict[str, str]:
+    """
+    Deletes the rows of the named querysets and of their operations, without
+    committing. Returns the fingerprints of the deleted querysets by name.
+    """
+    loas = dict(session.query(models.Queryset.name, models.Queryset.level_of_analysis_id)
+            .filter(models.Queryset.name.in_(names)))
+    if not loas:
+        return {}
+
+    chain = chain_cte(session, loas)
+    rows = session.execute(
+            select([models.Operation.__table__])
+            .where(models.Operation.operation_id.in_(select([chain.c.operation_id])))).fetchall()
+    chains = assemble_chains(rows)
+    fingerprints = {name: models.definition_fingerprint(loa, chains.get(name, [])) for name, loa in loas.items()}
+
+    # Operations are deleted from the roots down, since each one references the next.
+    positions = {}
+    following = {r.operation_id: r.next_operation_id for r in rows}
+    for root in (r.operation_id for r in rows if r.queryset_name is not None):
+        operation_id, position = root, 0
+        while operation_id is not None:
+            positions[operation_id] = position
+            operation_id, position = following.get(operation_id), position + 1
+    ordered = sorted(positions, key = positions.get)
+
+    session.execute(models.querysets_themes.delete().where(models.querysets_themes.c.queryset_name.in_(list(loas))))
+    for start in range(0, len(ordered), BULK_ROWS):
+        session.execute(models.Operation.__table__.delete()
+                .where(models.Operation.operation_id.in_(ordered[start:start + BULK_ROWS])))
+    session.execute(models.Queryset.__table__.delete().where(models.Queryset.name.in_(list(loas))))
+    return fingerprints
+
+def operation_rows(session: Session, chains: Dict[str, List[List[plans.OperationPlan]]]) -> List[Dict[str, Any]]:
+    """
+    Rows for the operations of the chains of each queryset. Chains are
+    ordered from their last operation, so that each operation is inserted
+    after the one it references.
+    """
+    ids = iter(allocate_operation_ids(session, sum(len(ch) for chs in chains.values() for ch in chs)))
+    rows = []
+    for queryset_name, queryset_chains in chains.items():
+        for chain in queryset_chains:
+            next_operation_id = None
+            chain_rows = []
+            for op in reversed(chain):
+                operation_id = next(ids)
+                chain_rows.append({
+                        "operation_id":      operation_id,
+                        "namespace":         models.RemoteNamespaces(op.namespace),
+                        "name":              op.name,
+                        "arguments":         list(op.arguments),
+                        "queryset_name":     None,
+                        "next_operation_id": next_operation_id,
+                    })
+                next_operation_id = operation_id
+            chain_rows[-1]["queryset_name"] = queryset_name
+            rows.extend(chain_rows)
+    return rows
+
+def allocate_operation_ids(session: Session, count: int) -> List[int]:
+    """
+    Ids for new operations. On Postgres they are taken from the sequence of
+    the operation table, and otherwise (for instance on SQLite, which
+    serializes writes) they follow the largest existing id.
+    """
+    if count == 0:
+        return []
+    if session.get_bind().dialect.name == "postgresql":
+        return [operation_id for operation_id, in session.execute(
+            text("SELECT nextval(pg_get_serial_sequence('operation', 'operation_id')) FROM generate_series(1, :count)"),
+            {"count": count})]
+    first = (session.query(func.max(models.Operation.operation_id)).scalar() or 0) + 1
+    return list(range(first, first + count))
+
+def assemble_chains(rows) -> Dict[str, List[List[plans.OperationPlan]]]:
+    """
+    Links up rows of the operation table into the chains of each queryset,
+    ordered by the ids of their roots.
+    """
+    by_id = {row.operation_id: row for row in rows}
+    chains: Dict[str, List[List[plans.OperationPlan]]] = {}
+    for root in sorted((r for r in by_id.values() if r.queryset_name is not None), key = lambda r: r.operation_id):
+        chain = []
+        row = root
+        while row is not None:
+            chain.append(plans.OperationPlan(row.namespace.value, row.name, tuple(row.arguments or ())))
+            row = by_id.get(row.next_operation_id)
+        chains.setdefault(root.queryset_name, []).append(chain)
+    return chains
+
+def operation_plan(posted: views_schema.Operation) -> plans.OperationPlan:
+    return plans.OperationPlan(models.RemoteNamespaces(posted.namespace).value, posted.name, tuple(posted.arguments))
+
+def validate_chain(chain: List[plans.OperationPlan]) -> None:
+    """
+    Checks what models.Operation validates when operations are created
+    through the ORM. Raises ValueError if the chain is not valid.
+    """
+    if not chain:
+        raise ValueError("Operation chains cannot be empty")
+    if any(op.namespace == models.RemoteNamespaces.base.value for op in chain[:-1]):
+        raise ValueError("Operation of namespace base cannot have a subsequent operation")
+    if not all(isinstance(a, (int, str)) for op in chain for a in op.arguments):
+        raise ValueError("Arguments must be either str or int")
+
+def insert_missing_names(session: Session, kind, names: Iterable[str]) -> None:
+    names = set(names)
+    if not names:
+        return
+    existing = {name for name, in session.query(kind.name).filter(kind.name.in_(list(names)))}
+    insert_rows(session, kind.__table__, [{"name": name} for name in sorted(names - existing)])
+
+def insert_rows(session: Session, table, rows: List[Dict[str, Any]]) -> None:
+    """
+    Inserts rows with a single executemany, which the engine sends as
+    multi-row INSERTs (see db.engine).
+    """
+    if rows:
+        session.execute(table.insert(), rows)
+
+def list_querysets(
+        session: Session,
+        prefix: Optional[str] = None,
+        loa: Optional[str] = None,
+        theme: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = None):
+    """
+    list_querysets
+    ==============
+
+    parameters:
+        session (sqlalchemy.orm.Session)
+        prefix (Optional[str]): Only querysets with names starting with prefix
+        loa (Optional[str]): Only querysets at this level of analysis
+        theme (Optional[str]): Only querysets associated with this theme
+        after (Optional[str]): Only querysets with names after this one
+        limit (Optional[int]): Max number of querysets
+    returns:
+        List[Row]: Rows of name and level_of_analysis_id, ordered by name
+
+    Filters are evaluated in the database, and only the listed columns are
+    read. Passing the name of the last queryset of a page as after gets the
+    next page (keyset pagination), which is as fast as getting the first.
+    """
+    table = models.Queryset.__table__
+    query = select([table.c.name, table.c.level_of_analysis_id])
+    if loa is not None:
+        query = query.where(table.c.level_of_analysis_id == loa)
+    if theme is not None:
+        query = query.where(table.c.name.in_(
+            select([models.querysets_themes.c.queryset_name])
+            .where(models.querysets_themes.c.theme_name == theme)))
+    return session.execute(page(query, table.c.name, prefix, after, limit)).fetchall()
+
+def list_themes(
+        session: Session,
+        prefix: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = None):
+    """
+    Rows of name and description of themes, ordered by name, see
+    list_querysets.
+    """
+    table = models.Theme.__table__
+    query = select([table.c.name, table.c.description])
+    return session.execute(page(query, table.c.name, prefix, after, limit)).fetchall()
+
+def page(query, name, prefix: Optional[str], after: Optional[str], limit: Optional[int]):
+    """
+    Orders a query by name, and keeps only names starting with prefix, after
+    after, and at most limit of them.
+    """
+    if prefix:
+        query = query.where(name.startswith(prefix, autoescape = True))
+    if after is not None:
+        query = query.where(name > after)
+    query = query.order_by(name)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+def get_theme(session: Session, name: str) -> Optional[Dict[str, Any]]:
+    """
+    The name, description and names of the querysets of a theme, read without
+    loading any models, or None if there is no such theme.
+    """
+    theme = session.execute(
+            select([models.Theme.__table__.c.description]).where(models.Theme.__table__.c.name == name)).first()
+    if theme is None:
+        return None
+    association = models.querysets_themes
+    querysets = session.execute(
+            select([association.c.queryset_name])
+            .where(association.c.theme_name == name)
+            .order_by(association.c.queryset_name))
+    return {
+            "name":        name,
+            "description": theme.description if theme.description is not None else "",
+            "querysets":   [queryset_name for queryset_name, in querysets],
+        }
+
 ModelType = TypeVar("ModelType")
 def get_or_create(kind: ModelType, id_name: str, session: Session, identifier:str)-> ModelType:
     o = session.query(kind).get(identifier)
@@ -5,10 +5,12 @@ data_retriever
 Exposes the DataRetriever class, which is used to fetch data pertaining to
 querysets.
 """
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import Executor
+from functools import partial
 import datetime
 import io
-from typing import List, Tuple, TypeVar
+from typing import List, Optional, Tuple, TypeVar
 import logging
 import asyncio
 from pymonad.either import Right, Left, Either
@@ -17,61 +19,279 @@ from toolz.functoolz import reduce
 import aiohttp
 from views_schema import viewser as schema
 import pandas as pd
+import pyarrow as pa
 
-from . import models
+from . import cache
+from . import plans
 from . import merge
 from . import response_result
+from . import serialization
+from .pending import PendingTracker
+from .selection import Selection
+from . import singleflight
+from . import tables
 
 logger = logging.getLogger(__name__)
 
+PIPELINES = ("pandas", "arrow")
+
 class DataRetriever():
     """
     DataRetriever
     =============
+
+    parameters:
+        url (str): URL of the data service
+        session (aiohttp.ClientSession)
+        column_cache (Optional[queryset_manager.cache.DiskCache]): Where to
+            keep fetched columns, which are then shared by all querysets
+            requesting the same operation path.
+        result_cache (Optional[queryset_manager.cache.DiskCache]): Where to
+            keep successful queryset data responses.
+        concurrency (int): Max number of columns fetched at once for one queryset.
+        max_concurrency (int): Max number of upstream requests in flight at
+            once, across all querysets.
+        merge_engine (str): How to merge columns, one of merge.MERGE_ENGINES.
+        pipeline (str): One of PIPELINES, "pandas" to parse, merge and
+            serialize data as pandas dataframes, or "arrow" to do so with
+            pyarrow tables.
+        executor (Optional[concurrent.futures.Executor]): Thread pool in which
+            to merge and serialize data, and to read and write the caches.
+        decode_executor (Optional[concurrent.futures.Executor]): Thread or
+            process pool in which to deserialize columns. Defaults to executor.
+        decode_concurrency (int): Max number of columns of a queryset
+            deserialized at once, usually the number of workers of the pool
+            they are deserialized in.
+        pending (Optional[queryset_manager.pending.PendingTracker]): Polls
+            columns that are pending upstream (202), which are then not
+            requested again until they are ready.
+
+    Without executors, all work is done on the event loop. Raises ValueError
+    for unknown merge engines and pipelines.
+
+    Concurrent requests for the same queryset data, and for the same
+    upstream URL, are coalesced into a single fetch with a shared result.
     """
-    def __init__(self, url: str, session: aiohttp.ClientSession):
+    def __init__(self,
+            url: str,
+            session: aiohttp.ClientSession,
+            column_cache: Optional[cache.DiskCache] = None,
+            result_cache: Optional[cache.DiskCache] = None,
+            concurrency: int = 16,
+            max_concurrency: int = 64,
+            merge_engine: str = "pandas",
+            pipeline: str = "pandas",
+            executor: Optional[Executor] = None,
+            decode_executor: Optional[Executor] = None,
+            decode_concurrency: int = 1,
+            pending: Optional[PendingTracker] = None):
         self._url = url
         self._session = session
-
-    async def queryset_data_response(self, queryset: models.Queryset) -> Tuple[int, bytes]:
+        self._column_cache = column_cache
+        self._result_cache = result_cache
+        self._concurrency = concurrency
+        self._upstream_limit = asyncio.Semaphore(max_concurrency)
+        if merge_engine not in merge.MERGE_ENGINES:
+            raise ValueError(f"Unknown merge engine \"{merge_engine}\", expected one of {', '.join(merge.MERGE_ENGINES)}")
+        if pipeline not in PIPELINES:
+            raise ValueError(f"Unknown pipeline \"{pipeline}\", expected one of {', '.join(PIPELINES)}")
+        self._merge_engine = merge_engine
+        self._pipeline = pipeline
+        self._executor = executor
+        self._decode_executor = decode_executor or executor
+        self._decode_concurrency = decode_concurrency
+        self._pending = pending
+        self._queryset_flights = singleflight.SingleFlight()
+        self._url_flights = singleflight.SingleFlight()
+
+    async def queryset_data_response(
+            self,
+            queryset: plans.QuerysetPlan,
+            start: Optional[int] = None,
+            end: Optional[int] = None,
+            encoding: serialization.Encoding = serialization.Encoding(compression = serialization.Compression()),
+            selection: Selection = Selection()) -> Tuple[int, bytes]:
         """
         queryset_data
         =============
 
         parameters:
-            queryset (queryset_manager.models.Queryset)
+            queryset (queryset_manager.plans.QuerysetPlan)
+            start (Optional[int]): First TIME value to include
+            end (Optional[int]): Last TIME value to include
+            encoding (queryset_manager.serialization.Encoding): Format and
+                compression of the data, with the defaults for the format if
+                no compression is given.
+            selection (queryset_manager.selection.Selection): Columns and
+                units to include
         returns:
             Tuple[int, bytes]: Can be passed on as a response
         """
-        response = await self.fetch_dataframe(queryset)
-        return response.either(self._error_response, self._data_response)
-
-    async def fetch_dataframe(self, queryset: models.Queryset)-> Either[List[response_result.ResponseResult], pd.DataFrame]:
+        encoding = encoding.with_defaults()
+        key = cache.result_key(queryset.fingerprint(), start, end, encoding.key, selection.key)
+        return await self._queryset_flights.do(
+                key, self._queryset_data_response, key, queryset, start, end, encoding, selection)
+
+    async def _queryset_data_response(self, key, queryset, start, end, encoding, selection) -> Tuple[int, bytes]:
+        if self._pipeline == "arrow":
+            response = await self.fetch_table(queryset, start, end, selection)
+        else:
+            response = await self.fetch_dataframe(queryset, start, end, selection)
+        return await self._run(self._executor, self._finish, key, response, encoding)
+
+    def _finish(self, key, response, encoding) -> Tuple[int, bytes]:
+        """
+        Serializes merged data, and adds it to the result cache.
+        """
+        if self._pipeline == "arrow":
+            status_code, content = response.either(
+                    self._error_response,
+                    lambda table: self._table_response(table, encoding))
+        else:
+            status_code, content = response.either(
+                    self._error_response,
+                    lambda df: self._data_response(df, encoding))
+        if status_code == 200 and self._result_cache is not None:
+            self._result_cache.put(key, content)
+        return status_code, content
+
+    async def fetch_dataframe(
+            self,
+            queryset: plans.QuerysetPlan,
+            start: Optional[int] = None,
+            end: Optional[int] = None,
+            selection: Selection = Selection())-> Either[List[response_result.ResponseResult], pd.DataFrame]:
         """
         _fetch_set
         ==========
 
         parameters:
-            queryset (queryset_manager.models.Queryset)
+            queryset (queryset_manager.plans.QuerysetPlan)
+            start (Optional[int]): First TIME value to include
+            end (Optional[int]): Last TIME value to include
+            selection (queryset_manager.selection.Selection): Columns and
+                units to include
         returns:
             Either[List[response_result.ResponseResult], pandas.DataFrame]
 
         Tries to fetch a dataframe corresponding to a queryset. Returns either
         a dataframe, or a list of responses, some of which are errors (Non 2xx
         responses).
+
+        Only the columns in the selection are fetched. Each column is
+        deserialized, keeping only the rows in the time window and selected
+        units, and merged into the result as soon as it arrives, so that its
+        raw bytes can be released right away.
+        """
+        return await self._fetch_merged(
+                queryset, start, end, selection,
+                response_result.dataframe_from_bytes,
+                merge.IncrementalMerge(self._merge_engine))
+
+    async def fetch_table(
+            self,
+            queryset: plans.QuerysetPlan,
+            start: Optional[int] = None,
+            end: Optional[int] = None,
+            selection: Selection = Selection())-> Either[List[response_result.ResponseResult], pa.Table]:
         """
-        results = await asyncio.gather(*map(self._http, self._urls_from_queryset(queryset)))
-        data = sequence([r.data for r in results])
-        dataframe = data.maybe(
-                Left([response_result.ResponseResult(500,"Failed to deserialize")]),
-                lambda dataframes: merge.merge(dataframes).maybe(Left([response_result.ResponseResult(500, "Failed to merge")]), Right))
+        fetch_table
+        ===========
 
-        errors = [r for r in results if r.pending or not r.ok]
-        errors = Just(errors) if errors else Nothing
+        parameters:
+            queryset (queryset_manager.plans.QuerysetPlan)
+            start (Optional[int]): First TIME value to include
+            end (Optional[int]): Last TIME value to include
+            selection (queryset_manager.selection.Selection): Columns and
+                units to include
+        returns:
+            Either[List[response_result.ResponseResult], pyarrow.Table]
 
-        return errors.maybe(
-                dataframe,
-                Left)
+        Like fetch_dataframe, but deserializes and merges columns as pyarrow
+        tables, without converting them to pandas.
+        """
+        return await self._fetch_merged(
+                queryset, start, end, selection,
+                response_result.table_from_bytes,
+                tables.IncrementalTableMerge())
+
+    async def _fetch_merged(self, queryset, start, end, selection, deserialize, merger):
+        """
+        Columns are decoded as soon as they are fetched, with as many decodes
+        in flight as the decode pool has workers, and added to the merger as
+        their decodes finish. Each column holds one of concurrency slots from
+        the start of its fetch until its decode has finished, so that at most
+        concurrency fetched bodies are held at once, however slow decoding is.
+        """
+        urls = self._urls_from_queryset(queryset, selection.columns)
+        queued = iter(enumerate(urls))
+        fetching = set()
+        fetched = deque()
+        decoding = set()
+
+        async def decode(position, content):
+            return position, await self._run(self._decode_executor, deserialize, content, start, end, selection.units)
+
+        def start_work():
+            while fetched and len(decoding) < self._decode_concurrency:
+                decoding.add(asyncio.ensure_future(decode(*fetched.popleft())))
+            while len(fetching) + len(fetched) + len(decoding) < self._concurrency:
+                position, url = next(queued, (None, None))
+                if url is None:
+                    break
+                fetching.add(asyncio.ensure_future(self._positioned_http(position, url)))
+
+        errors = []
+        deserialized = True
+        try:
+            start_work()
+            while fetching or decoding:
+                done, _ = await asyncio.wait(fetching | decoding, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task in fetching:
+                        fetching.discard(task)
+                        position, result = task.result()
+                        self._watch_pending(urls[position], result)
+                        if result.pending or not result.ok:
+                            errors.append((position, result))
+                        elif result.status_code != 200:
+                            deserialized = False
+                        elif not errors and deserialized:
+                            fetched.append((position, result.content))
+                        del result
+                    else:
+                        decoding.discard(task)
+                        position, data = task.result()
+                        if data.is_nothing():
+                            deserialized = False
+                        elif not errors and deserialized:
+                            await self._run(self._executor, merger.add, position, data.value)
+                        del data
+                    del task
+                if errors or not deserialized:
+                    fetched.clear()
+                start_work()
+        finally:
+            for task in fetching | decoding:
+                task.cancel()
+
+        if errors:
+            return Left([result for _, result in sorted(errors, key = lambda e: e[0])])
+
+        if not deserialized:
+            return Left([response_result.ResponseResult(500,"Failed to deserialize")])
+
+        merged = await self._run(self._executor, merger.result)
+        return merged.maybe(Left([response_result.ResponseResult(500, "Failed to merge")]), Right)
+
+    @staticmethod
+    async def _run(executor: Optional[Executor], function, *args):
+        """
+        Calls function in executor, or directly if there is no executor.
+        """
+        if executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
 
     def _url_from_path(self, path: str) -> str:
         """
@@ -88,19 +308,20 @@ class DataRetriever():
         """
         return self._url + "/" + path
 
-    def _urls_from_queryset(self, queryset) -> List[str]:
+    def _urls_from_queryset(self, queryset, columns: Optional[Tuple[str, ...]] = None) -> List[str]:
         """
         _urls_from_queryset
         ===================
 
         parameters:
-            queryset (queryset_manager.models.Queryset)
+            queryset (queryset_manager.plans.QuerysetPlan)
+            columns (Optional[Tuple[str, ...]]): Only these columns, if given
         returns:
             List[str]
 
         Returns queryset operation paths as urls
         """
-        return [self._url_from_path(path) for path in queryset.paths()]
+        return [self._url_from_path(path) for path in queryset.paths(columns)]
 
     def _error_response(self, errors: List[response_result.ResponseResult]) -> Tuple[int, bytes]:
         """
@@ -128,23 +349,51 @@ class DataRetriever():
 
         return status_code, dump.json().encode()
 
-    def _data_response(self, data: pd.DataFrame) -> Tuple[int, bytes]:
+    def _data_response(
+            self,
+            data: pd.DataFrame,
+            encoding: serialization.Encoding = serialization.Encoding()) -> Tuple[int, bytes]:
         """
         _data_response
         ==============
 
         parameters:
             data (pandas.DataFrame)
+            encoding (queryset_manager.serialization.Encoding)
         returns:
             Tuple[int, bytes]
 
-        Returns pandas dataframe as parquet bytes, along with a 200 code.
+        Returns pandas dataframe as bytes (parquet, unless another format is
+        requested), along with a 200 code.
         """
         #data = compatibility.with_index_names(data, queryset.level_of_analysis.name)
+        encoding = encoding.with_defaults()
+        if encoding.format is not serialization.Format.parquet:
+            return 200, serialization.serialize_table(pa.Table.from_pandas(data), encoding)
+
         bytes_buffer = io.BytesIO()
-        data.to_parquet(bytes_buffer,compression="gzip")
+        data.to_parquet(bytes_buffer, **encoding.compression.parquet_arguments)
         return 200, bytes_buffer.getvalue()
 
+    def _table_response(
+            self,
+            data: pa.Table,
+            encoding: serialization.Encoding = serialization.Encoding()) -> Tuple[int, bytes]:
+        """
+        _table_response
+        ===============
+
+        parameters:
+            data (pyarrow.Table)
+            encoding (queryset_manager.serialization.Encoding)
+        returns:
+            Tuple[int, bytes]
+
+        Returns pyarrow table as bytes (parquet, unless another format is
+        requested), along with a 200 code.
+        """
+        return 200, serialization.serialize_table(data, encoding)
+
     async def _http(self, url: str) -> response_result.ResponseResult:
         """
         _http
@@ -156,7 +405,94 @@ class DataRetriever():
         returns:
             response_result.ResponseResult
 
+        Successful responses are served from, and added to, the column cache
+        if there is one.
         """
+        return await self._url_flights.do(url, self._cached_fetch, url)
+
+    async def _positioned_http(self, position: int, url: str) -> Tuple[int, response_result.ResponseResult]:
+        return position, await self._unless_pending(url)
+
+    async def _limited_http(self, limit: asyncio.Semaphore, url: str) -> response_result.ResponseResult:
+        async with limit:
+            return await self._unless_pending(url)
+
+    async def _unless_pending(self, url: str) -> response_result.ResponseResult:
+        if self._pending is not None and self._pending.pending(url):
+            return response_result.ResponseResult(202, f"{url} is pending")
+        return await self._http(url)
+
+    async def warm(self, queryset: plans.QuerysetPlan) -> int:
+        """
+        warm
+        ====
+
+        parameters:
+            queryset (queryset_manager.plans.QuerysetPlan)
+        returns:
+            int: 200 if all columns were fetched, 202 if some are pending
+                upstream, or else the most serious error status.
+
+        Fetches all of the columns of a queryset into the column cache, without
+        deserializing them. Pending columns are polled until they are ready.
+        Only the status of each fetch is kept, not its content.
+        """
+        limit = asyncio.Semaphore(self._concurrency)
+        urls = self._urls_from_queryset(queryset)
+        statuses = await asyncio.gather(*[self._warm_column(limit, url) for url in urls])
+
+        errors = [s for s in statuses if s != 202 and not 200 <= s < 300]
+        if errors:
+            return max(errors)
+        return 202 if 202 in statuses else 200
+
+    async def _warm_column(self, limit: asyncio.Semaphore, url: str) -> int:
+        result = await self._limited_http(limit, url)
+        self._watch_pending(url, result)
+        return result.status_code
+
+    def _watch_pending(self, url: str, result: response_result.ResponseResult) -> None:
+        if result.pending and self._pending is not None:
+            self._pending.watch(url, partial(self._poll, url))
+
+    async def _poll(self, url: str) -> int:
+        return (await self._http(url)).status_code
+
+    def pending_urls(self, queryset: plans.QuerysetPlan, selection: Selection = Selection()) -> List[str]:
+        """
+        pending_urls
+        ============
+
+        parameters:
+            queryset (queryset_manager.plans.QuerysetPlan)
+            selection (queryset_manager.selection.Selection)
+        returns:
+            List[str]: URLs of the queryset's columns that are being polled
+                because they are pending upstream.
+        """
+        if self._pending is None:
+            return []
+        return [url for url in self._urls_from_queryset(queryset, selection.columns) if self._pending.pending(url)]
+
+    async def _cached_fetch(self, url: str) -> response_result.ResponseResult:
+        if self._column_cache is None:
+            return await self._limited_fetch(url)
+
+        key = cache.url_key(url)
+        content = await self._run(self._executor, self._column_cache.get, key)
+        if content is not None:
+            return response_result.ResponseResult(200, content)
+
+        result = await self._limited_fetch(url)
+        if result.status_code == 200:
+            await self._run(self._executor, self._column_cache.put, key, result.content)
+        return result
+
+    async def _limited_fetch(self, url: str) -> response_result.ResponseResult:
+        async with self._upstream_limit:
+            return await self._fetch(url)
+
+    async def _fetch(self, url: str) -> response_result.ResponseResult:
         async with self._session.get(url) as response:
             return await response_result.ResponseResult.from_aiohttp_response(response)
 
@@ -18,6 +18,14 @@ def get_con():
 
     return psycopg2.connect(" ".join(connection_parameters))
 
-engine = create_engine("postgresql+psycopg2://", creator = get_con)
+engine = create_engine("postgresql+psycopg2://",
+        creator       = get_con,
+        pool_size     = settings.DB_POOL_SIZE,
+        max_overflow  = settings.DB_MAX_OVERFLOW,
+        pool_timeout  = settings.DB_POOL_TIMEOUT,
+        pool_recycle  = settings.DB_POOL_RECYCLE,
+        pool_pre_ping = settings.DB_POOL_PRE_PING,
+        # Sends executemany INSERTs as multi-row INSERTs (see crud.insert_rows)
+        executemany_mode = "values")
 
 Session = sessionmaker(engine)
@@ -0,0 +1,192 @@
+"""
+definitions
+===========
+
+Exposes the DefinitionCache class, a process-local cache of queryset plans
+(see plans.QuerysetPlan), so that requests for hot querysets do not need to
+go to the database at all, and the cache instance used by the app
+(querysets).
+
+Entries are invalidated when querysets are created, replaced, deleted or
+associated with themes. Each invalidation bumps the version of the cache, and
+definitions loaded from the database are only added if the version did not
+change while they were loaded, so that a definition read just before a write
+is never cached after it.
+
+Other workers learn about writes through NOTIFY on the NOTIFY_CHANNEL channel
+of the database, if QUERYSET_CACHE_NOTIFY is set (see Listener), and
+otherwise only when their entries expire after QUERYSET_CACHE_TTL seconds.
+"""
+import time
+import select
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from . import models
+from . import plans
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "queryset_definitions"
+
+class DefinitionCache():
+    """
+    DefinitionCache
+    ===============
+
+    parameters:
+        max_size (int): Max number of querysets. 0 disables the cache.
+        ttl (Optional[float]): Max age of entries in seconds.
+
+    Least recently used entries are evicted beyond max_size. The cache is
+    safe to use from several threads. Hits and misses are counted per process.
+    """
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[plans.QuerysetPlan, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    def get(self, name: str, load: Callable[[], Optional[models.Queryset]]) -> Optional[plans.QuerysetPlan]:
+        """
+        get
+        ===
+
+        parameters:
+            name (str): Name of the queryset
+            load (Callable[[], Optional[models.Queryset]]): Loads the queryset
+                from the database, see crud.get_queryset.
+        returns:
+            Optional[plans.QuerysetPlan]: None if there is no such queryset
+
+        Missing querysets are not cached.
+        """
+        plan = self.cached(name)
+        if plan is not None:
+            return plan
+
+        with self._lock:
+            self.misses += 1
+            version = self.version
+
+        queryset = load()
+        if queryset is None:
+            return None
+        plan = queryset.plan()
+
+        with self._lock:
+            if self.enabled and self.version == version:
+                self._entries[name] = (plan, time.monotonic())
+                self._entries.move_to_end(name)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last = False)
+        return plan
+
+    def cached(self, name: str) -> Optional[plans.QuerysetPlan]:
+        """
+        The named queryset if it is cached, without going to the database.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if self._ttl is not None and time.monotonic() - entry[1] > self._ttl:
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return entry[0]
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Forgets the named queryset, or all querysets if name is None, and
+        bumps the version of the cache.
+        """
+        with self._lock:
+            self.version += 1
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                    "enabled": self.enabled,
+                    "version": self.version,
+                    "hits":    self.hits,
+                    "misses":  self.misses,
+                    "entries": len(self._entries),
+                }
+
+class Listener():
+    """
+    Listener
+    ========
+
+    parameters:
+        cache (DefinitionCache)
+        connect (Callable[[], psycopg2.extensions.connection]): Opens a
+            connection to the database, see db.get_con.
+        reconnect_interval (float): Seconds to wait before reconnecting
+
+    Listens for notifications of written querysets on NOTIFY_CHANNEL in a
+    background thread, and invalidates them in the cache. The payload of a
+    notification is the name of the queryset. Since notifications may have
+    been missed while (re)connecting, the whole cache is invalidated each
+    time the connection is opened.
+    """
+    def __init__(self, cache: DefinitionCache, connect: Callable[[], Any], reconnect_interval: float = 5):
+        self._cache = cache
+        self._connect = connect
+        self._reconnect_interval = reconnect_interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = "definition-listener", daemon = True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Lost connection listening on %s, reconnecting", NOTIFY_CHANNEL)
+                self._stopped.wait(self._reconnect_interval)
+
+    def _listen(self) -> None:
+        connection = self._connect()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            self._cache.invalidate()
+
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([connection], [], [], 1)
+                if not readable:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    logger.debug("Queryset %s was written, invalidating", notification.payload)
+                    self._cache.invalidate(notification.payload)
+        finally:
+            connection.close()
+
+querysets = DefinitionCache(
+        settings.QUERYSET_CACHE_SIZE,
+        settings.QUERYSET_CACHE_TTL)
@@ -1,5 +1,6 @@
 import logging
-from typing import List
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 from pymonad.maybe import Maybe, Nothing, Just
 from toolz.functoolz import compose, reduce, curry
@@ -17,12 +18,274 @@ def pandas_merge(dataframes: List[pd.DataFrame])-> Maybe[pd.DataFrame]:
         Maybe[pd.DataFrame]
 
     Inner merges a list of pandas dataframes using their indices.
+
+    Dataframes with the same index as the first one are put side by side
+    directly, and only the others are merged.
     """
+    if not dataframes:
+        return Nothing
+
+    same = same_index(dataframes)
+    columns = [name for df in dataframes for name in df.columns]
+    if any(same[1:]) and len(set(columns)) == len(columns) and dataframes[0].index.is_unique:
+        aligned = assemble([df for df, s in zip(dataframes, same) if s], None, dataframes[0].index)
+        rest = [df for df, s in zip(dataframes, same) if not s]
+        merged = pandas_merge([aligned] + rest)
+        return merged.then(lambda df: df if list(df.columns) == columns else df[columns])
+
     try:
         return Just(reduce(lambda a,b: a.merge(b, left_index = True, right_index = True, how = "inner"), dataframes))
     except pd.errors.MergeError:
         return Nothing
 
+def columnar_merge(dataframes: List[pd.DataFrame])-> Maybe[pd.DataFrame]:
+    """
+    columnar_merge
+    ==============
+
+    parameters:
+        dataframes (List[pd.DataFrame])
+    returns:
+        Maybe[pd.DataFrame]
+
+    Inner merges a list of doubly-indexed pandas dataframes using their
+    indices, with the same result as pandas_merge. Instead of merging pairwise,
+    the intersection of the indices is computed once, using integer keys
+    encoding each (TIME, UNIT) pair, and all columns are then copied into the
+    result in a single pass.
+
+    Dataframes with the same index as the first one are not looked up at
+    all. If all dataframes share an index, the columns are just copied into
+    the result.
+
+    Falls back to pandas_merge if the index values are not integers, or if any
+    index has duplicates.
+    """
+    if not dataframes:
+        return Nothing
+
+    index = dataframes[0].index
+    same = same_index(dataframes)
+    if all(same) and index.is_unique:
+        return Just(assemble(dataframes, None, index))
+
+    different = [df.index for df, s in zip(dataframes, same) if not s]
+    keys = index_keys([index] + different)
+    if keys is None:
+        return pandas_merge(dataframes)
+
+    first, *rest = keys
+    found = np.ones(len(first), dtype = bool)
+    lookups = []
+    for other in rest:
+        rows = lookup(other, first)
+        found &= rows >= 0
+        lookups.append(rows)
+
+    lookups = iter(lookups)
+    if found.all():
+        positions = [None if s else next(lookups) for s in same]
+        return Just(assemble(dataframes, positions, index))
+
+    rows = np.flatnonzero(found)
+    positions = [rows if s else next(lookups)[rows] for s in same]
+    return Just(assemble(dataframes, positions, index[rows]))
+
+def outer_merge(dataframes: List[pd.DataFrame])-> Maybe[pd.DataFrame]:
+    """
+    outer_merge
+    ===========
+
+    parameters:
+        dataframes (List[pd.DataFrame])
+    returns:
+        Maybe[pd.DataFrame]
+
+    Outer merges a list of doubly-indexed pandas dataframes using their
+    indices, like pandas.concat(dataframes, axis = 1) followed by sorting,
+    but using integer keys encoding each (TIME, UNIT) pair instead of
+    aligning the indices pairwise. Rows missing from a dataframe are filled
+    with missing values, and the result is sorted by index. Column names
+    are kept as they are.
+
+    Returns Nothing if the index values are not integers, or if any index
+    has duplicates.
+    """
+    if not dataframes:
+        return Nothing
+
+    levels = index_levels([df.index for df in dataframes])
+    keys = None if levels is None else level_keys(levels)
+    if keys is None:
+        return Nothing
+
+    union, first_rows, inverse = np.unique(np.concatenate(keys), return_index = True, return_inverse = True)
+    index = pd.MultiIndex.from_arrays(
+            [np.concatenate(level)[first_rows] for level in zip(*levels)],
+            names = dataframes[0].index.names)
+
+    data = {}
+    offset = 0
+    for i, df in enumerate(dataframes):
+        positions = inverse[offset : offset + len(df)]
+        offset += len(df)
+        if len(positions) and np.bincount(positions).max() > 1:
+            return Nothing
+        rows = np.full(len(union), -1)
+        rows[positions] = np.arange(len(df))
+        for j in range(df.shape[1]):
+            data[(i, j)] = pd.api.extensions.take(df.iloc[:, j].to_numpy(), rows, allow_fill = True)
+    merged = pd.DataFrame(data, index = index)
+    merged.columns = [name for df in dataframes for name in df.columns]
+    return Just(merged)
+
+def same_index(dataframes: List[pd.DataFrame])-> List[bool]:
+    """
+    same_index
+    ==========
+
+    parameters:
+        dataframes (List[pandas.DataFrame])
+    returns:
+        List[bool]: Whether each dataframe has the same index as the first one.
+
+    Cheap compared to a join: indices of different lengths are never
+    compared, and equal indices are compared element-wise without hashing.
+    """
+    first = dataframes[0].index
+    return [df.index is first or (len(df.index) == len(first) and df.index.equals(first)) for df in dataframes]
+
+def lookup(keys: np.ndarray, wanted: np.ndarray)-> np.ndarray:
+    """
+    lookup
+    ======
+
+    parameters:
+        keys (numpy.ndarray): Unique keys
+        wanted (numpy.ndarray): Keys to look up
+    returns:
+        numpy.ndarray: Position of each wanted key in keys, or -1 if missing.
+    """
+    if not len(keys):
+        return np.full(len(wanted), -1)
+
+    sorter = None if np.all(keys[1:] > keys[:-1]) else np.argsort(keys, kind = "stable")
+    positions = np.searchsorted(keys, wanted, sorter = sorter)
+    positions[positions == len(keys)] = 0
+    if sorter is not None:
+        positions = sorter[positions]
+    positions[keys[positions] != wanted] = -1
+    return positions
+
+def index_keys(indices: List[pd.MultiIndex])-> Optional[List[np.ndarray]]:
+    """
+    index_keys
+    ==========
+
+    parameters:
+        indices (List[pandas.MultiIndex]): (TIME, UNIT) indices
+    returns:
+        Optional[List[numpy.ndarray]]: An int64 key for each row of each index
+
+    Encodes (TIME, UNIT) pairs as int64 keys that are comparable across all
+    of the indices. Returns None if the indices can't be encoded that way,
+    because they are not integer-valued, have duplicates, or span too wide
+    a range.
+    """
+    if not all(index.nlevels == 2 and index.is_unique for index in indices):
+        return None
+    levels = index_levels(indices)
+    return None if levels is None else level_keys(levels)
+
+def index_levels(indices: List[pd.Index])-> Optional[List[Tuple[np.ndarray, np.ndarray]]]:
+    """
+    The int64 (TIME, UNIT) values of each index, or None if any index is not
+    a two-level, integer-valued index.
+    """
+    levels = []
+    for index in indices:
+        if index.nlevels != 2:
+            return None
+        time, unit = (index.get_level_values(i) for i in range(2))
+        if not (pd.api.types.is_integer_dtype(time) and pd.api.types.is_integer_dtype(unit)):
+            return None
+        levels.append((time.to_numpy(dtype = np.int64), unit.to_numpy(dtype = np.int64)))
+    return levels
+
+def level_keys(levels: List[Tuple[np.ndarray, np.ndarray]])-> Optional[List[np.ndarray]]:
+    """
+    level_keys
+    ==========
+
+    parameters:
+        levels (List[Tuple[numpy.ndarray, numpy.ndarray]]): int64 (TIME, UNIT) values
+    returns:
+        Optional[List[numpy.ndarray]]: An int64 key for each row
+
+    Encodes (TIME, UNIT) pairs as int64 keys, or returns None if the values
+    span too wide a range to do so.
+    """
+    if not any(len(time) for time, _ in levels):
+        return [np.empty(0, dtype = np.int64) for _ in levels]
+
+    time_min = min(time.min() for time, _ in levels if len(time))
+    unit_min = min(unit.min() for _, unit in levels if len(unit))
+    time_span = max(time.max() for time, _ in levels if len(time)) - time_min + 1
+    unit_span = max(unit.max() for _, unit in levels if len(unit)) - unit_min + 1
+    if int(time_span) * int(unit_span) >= 2**63:
+        return None
+
+    return [(time - time_min) * unit_span + (unit - unit_min) for time, unit in levels]
+
+def assemble(
+        dataframes: List[pd.DataFrame],
+        positions: Optional[List[Optional[np.ndarray]]],
+        index: pd.Index)-> pd.DataFrame:
+    """
+    assemble
+    ========
+
+    parameters:
+        dataframes (List[pandas.DataFrame])
+        positions (Optional[List[Optional[numpy.ndarray]]]): Row positions to
+            take from each dataframe. None means all rows, as they are.
+        index (pandas.Index): Index of the result
+    returns:
+        pandas.DataFrame
+
+    Takes the rows at the given positions from each dataframe, and puts all
+    of the columns side by side. If all columns share a numpy dtype, they
+    are written into a single preallocated block. Otherwise columns are
+    taken one by one, keeping extension dtypes (Int64, category, ...) as
+    they are.
+    """
+    if positions is None:
+        positions = [None] * len(dataframes)
+    columns = [name for df in dataframes for name in df.columns]
+    dtypes = {dtype for df in dataframes for dtype in df.dtypes}
+
+    if len(dtypes) == 1 and all(isinstance(dtype, np.dtype) for dtype in dtypes):
+        block = np.empty((len(columns), len(index)), dtype = dtypes.pop())
+        row = 0
+        for df, rows in zip(dataframes, positions):
+            values = df.to_numpy()
+            for i in range(values.shape[1]):
+                if rows is None:
+                    block[row] = values[:, i]
+                else:
+                    np.take(values[:, i], rows, out = block[row])
+                row += 1
+        return pd.DataFrame(block.T, index = index, columns = columns, copy = False)
+
+    data = {}
+    for i, (df, rows) in enumerate(zip(dataframes, positions)):
+        for j in range(df.shape[1]):
+            values = df.iloc[:, j].array
+            data[(i, j)] = values.copy() if rows is None else values.take(rows)
+    assembled = pd.DataFrame(data, index = index)
+    assembled.columns = columns
+    return assembled
+
 def list_with_distinct_names(dfs: List[pd.DataFrame])-> List[pd.DataFrame]:
     seen = []
     for df in dfs:
@@ -76,3 +339,91 @@ merge = compose(
             list_with_distinct_names,
             ensure_index_names,
         )
+
+MERGE_ENGINES = {
+        "pandas":   pandas_merge,
+        "columnar": columnar_merge,
+    }
+
+class IncrementalMerge():
+    """
+    IncrementalMerge
+    ================
+
+    Inner merges dataframes one at a time, in whatever order they become
+    available, so that each one can be released as soon as it has been
+    merged. Each dataframe is added with its position in the queryset, and the
+    result has the same column order, column names and index names as
+    merge() would give for the dataframes in position order.
+
+    parameters:
+        engine (str): One of MERGE_ENGINES. With the "pandas" engine,
+            dataframes are merged pairwise as they are added. Other engines
+            merge all of the dataframes at once when the result is requested.
+    """
+    def __init__(self, engine: str = "pandas"):
+        if engine not in MERGE_ENGINES:
+            raise ValueError(f"Unknown merge engine \"{engine}\", expected one of {', '.join(MERGE_ENGINES)}")
+        self._engine = engine
+        self._merged: Optional[pd.DataFrame] = None
+        self._dataframes: Dict[int, pd.DataFrame] = {}
+        self._columns: Dict[int, List[str]] = {}
+        self._index_names: Dict[int, Tuple[str, str]] = {}
+        self._failed = False
+
+    def add(self, position: int, dataframe: pd.DataFrame) -> None:
+        if self._failed:
+            return
+
+        if tuple(dataframe.index.names) != (None, None):
+            self._index_names[position] = tuple(dataframe.index.names)
+        self._columns[position] = list(dataframe.columns)
+
+        dataframe.index.names = ("TIME", "UNIT")
+        dataframe.columns = [self._label(position, i) for i in range(dataframe.shape[1])]
+
+        if self._engine != "pandas":
+            self._dataframes[position] = dataframe
+        elif self._merged is None:
+            self._merged = dataframe
+        else:
+            try:
+                self._merged = self._merged.merge(dataframe, left_index = True, right_index = True, how = "inner")
+            except pd.errors.MergeError:
+                self._failed = True
+                self._merged = None
+
+    def result(self) -> Maybe[pd.DataFrame]:
+        """
+        result
+        ======
+
+        returns:
+            Maybe[pandas.DataFrame]: The merged dataframe, or Nothing if nothing
+                was added or merging failed.
+        """
+        positions = sorted(self._columns)
+        if self._dataframes:
+            merged = MERGE_ENGINES[self._engine]([self._dataframes.pop(p) for p in positions])
+            self._merged = merged.value if merged.is_just() else None
+            self._failed = merged.is_nothing()
+
+        if self._failed or self._merged is None:
+            return Nothing
+
+        labels = [self._label(p, i) for p in positions for i in range(len(self._columns[p]))]
+        merged = self._merged if list(self._merged.columns) == labels else self._merged[labels]
+        merged.columns = distinct_names([name for p in positions for name in self._columns[p]])
+
+        if self._index_names:
+            merged.index.names = self._index_names[min(self._index_names)]
+        else:
+            logger.warning("No index names found in list of dataframes, using fallback")
+
+        if not merged.index.is_monotonic_increasing:
+            merged = merged.sort_index()
+        return Just(merged)
+
+    @staticmethod
+    def _label(position: int, column: int) -> str:
+        return f"{position}/{column}"
@@ -1,10 +1,13 @@
-import os
 import enum
-from typing import List
+import json
+import hashlib
+from typing import Iterable, List, Optional, Union
 from sqlalchemy import Column,String,Enum,Integer,ForeignKey,JSON,MetaData,Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship,validates
 
+from . import plans
+
 metadata = MetaData()
 Base = declarative_base(metadata=metadata)
 
@@ -113,22 +116,71 @@ class Queryset(Base):
             queryset.operation_roots.append(root)
         return queryset
 
-    def paths(self):
+    def paths(self, columns: Optional[Iterable[str]] = None):
         loa = self.level_of_analysis.name
-        return [os.path.join(loa,op.operation_chain_path()) for op in self.operation_roots]
+        return [f"{loa}/{chain_path(ch)}" for ch in self.op_chains(columns)]
 
-    def op_chains(self):
-        return [op.get_chain() for op in self.operation_roots]
+    def op_chains(self, columns: Optional[Iterable[str]] = None):
+        """
+        The operation chains of the queryset, or only those producing the
+        named columns. Chains are walked once and remembered for as long as
+        the operation roots stay the same.
+        """
+        chains = self._chains()
+        if columns is None:
+            return list(chains)
+        columns = set(columns)
+        return [ch for ch in chains if chain_column_name(ch) in columns]
 
-    def dict(self):
+    def column_names(self) -> List[str]:
+        return [chain_column_name(ch) for ch in self._chains()]
+
+    def selected_roots(self, columns: Optional[Iterable[str]] = None):
+        """
+        The operation roots of the chains that produce the named columns, in
+        queryset order, or all of them if columns is None.
+        """
+        return [ch[0] for ch in self.op_chains(columns)]
+
+    def dict(self, columns: Optional[Iterable[str]] = None):
         return {
             "name":        self.name,
             "loa":         self.level_of_analysis.name,
             "description": self.description,
             "themes":      [th.name for th in self.themes],
-            "operations":  [[op.dict() for op in ch] for ch in self.op_chains()]
+            "operations":  [[op.dict() for op in ch] for ch in self.op_chains(columns)]
         }
 
+    def _chains(self) -> List[List["Operation"]]:
+        roots = list(self.operation_roots)
+        cached = self.__dict__.get("_chain_cache")
+        if cached is None or len(cached) != len(roots) or any(ch[0] is not r for ch, r in zip(cached, roots)):
+            cached = [root.get_chain() for root in roots]
+            self.__dict__["_chain_cache"] = cached
+        return cached
+
+    def fingerprint(self):
+        """
+        A digest of the parts of the queryset that determine its data: the
+        level of analysis and the ordered operation chains.
+        """
+        return definition_fingerprint(self.level_of_analysis.name, self.op_chains())
+
+    def plan(self) -> plans.QuerysetPlan:
+        """
+        The queryset as a plan, which is detached from the session, and can
+        be used on the request path instead of the queryset.
+        """
+        chains = self.op_chains()
+        return plans.QuerysetPlan(
+                name        = self.name,
+                loa         = self.level_of_analysis.name,
+                description = self.description,
+                themes      = tuple(th.name for th in self.themes),
+                chains      = tuple(tuple(op.plan() for op in ch) for ch in chains),
+                columns     = tuple(chain_column_name(ch) for ch in chains),
+                fingerprint = self.fingerprint())
+
     def path(self):
         return "queryset/"+self.name
 
@@ -179,30 +231,32 @@ class Operation(Base):
             "arguments": self.arguments,
             }
 
+    def plan(self) -> plans.OperationPlan:
+        return plans.OperationPlan(self.namespace.value, self.name, tuple(self.arguments or ()))
+
     def operation_path(self):
         """
-        Show operation as path
+        Show operation as path, see plans.operation_path
         """
-        components = [self.namespace.value, self.name]
-
-        if not self.arguments:
-            args = ["_"]
-        else:
-            args = self.arguments
-        components.append("__".join([str(a) for a in args]))
+        return plans.operation_path(self.plan())
 
-        return os.path.join(*components)
+    def column_name(self) -> str:
+        """
+        Name of the column produced by the chain starting with this operation,
+        see chain_column_name.
+        """
+        return chain_column_name(self.get_chain())
 
     def get_chain(self,previous=None):
-        if previous is None:
-            previous = []
-        previous.append(self)
-        if self.next_operation:
-            return self.next_operation.get_chain(previous=previous)
-        return previous
+        chain = [] if previous is None else previous
+        operation = self
+        while operation is not None:
+            chain.append(operation)
+            operation = operation.next_operation
+        return chain
 
     def operation_chain_path(self):
-        return os.path.join(*[op.operation_path() for op in self.get_chain()])
+        return chain_path(self.get_chain())
 
     @validates("next_operation")
     def validate_next_operation(self,_,next_operation):
@@ -232,6 +286,30 @@ class Operation(Base):
     def __repr__(self):
         return f"Operation(namespace={self.namespace.value}, name={self.name})"
 
+def chain_path(chain: List[Operation])-> str:
+    return plans.chain_path(tuple(op.plan() for op in chain))
+
+def definition_fingerprint(loa: str, chains: Iterable[Iterable[Union[Operation, plans.OperationPlan]]])-> str:
+    """
+    See Queryset.fingerprint. Operations can be either models or plans.
+    """
+    definition = {
+        "loa":        loa,
+        "operations": [[op.dict() for op in ch] for ch in chains]
+    }
+    return hashlib.sha256(json.dumps(definition, sort_keys = True).encode()).hexdigest()
+
+def chain_column_name(chain: List[Operation])-> str:
+    """
+    Name of the column produced by a chain of operations: the argument of a
+    leading util.rename transform, or else the column part of the name of
+    the terminal (base) operation.
+    """
+    first = chain[0]
+    if first.namespace is RemoteNamespaces.trf and first.name == "util.rename" and first.arguments:
+        return str(first.arguments[0])
+    return chain[-1].name.split(".")[-1]
+
 def chain_operations(operations: List[Operation])-> Operation:
     """
     Chains a list of operations together, returning the "root" operation that
@@ -1,13 +1,13 @@
-import sys
 from datetime import datetime,date
 import logging
-from typing import Optional
-
-from dateutil.relativedelta import relativedelta
+from typing import Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+from . import compatibility
 from . import constants
+from . import merge
 
 logger = logging.getLogger(__name__)
 
@@ -15,49 +15,115 @@ secdelta = lambda time: (datetime.now()-time).seconds
 
 def join(*dataframes):
     """
-    Joins two dataframes to the lowest common set of TIME indices, by concatenation.
-    Super fast, but relies on two very important assumptions:
-    TIME is a continuous series of indices
-    UNIT has the same number of unique values for each TIME
+    Joins dataframes on the common window of TIME indices, by concatenation.
+
+    The window is found from the TIME level of each index, and each dataframe
+    is subset to it positionally (see time_window), without being sorted or
+    otherwise modified. If the subset indices are all identical, which is the
+    case when TIME is a continuous series and each TIME has the same UNITs,
+    the columns are copied side by side in a single pass. Otherwise, the
+    dataframes are aligned on their index values.
     """
+    mark = datetime.now()
 
-    start = 0
-    end = sys.maxsize
+    bounds = [time_bounds(df) for df in dataframes]
+    if any(b is None for b in bounds):
+        windows = [df.iloc[0:0] for df in dataframes]
+    else:
+        start = max(first for first,_ in bounds)
+        end = min(last for _,last in bounds)
+        windows = [time_window(df,start,end) for df in dataframes]
+    logger.debug("Subset dataframes (%s)",secdelta(mark))
 
-    for df in dataframes:
-        logger.debug("Processing a DF")
-        mark = datetime.now()
-        if not df.index.is_monotonic:
-            logger.debug("Sorting...")
-            df.sort_index(inplace=True)
-            logger.debug("Sorted (%s)",secdelta(mark))
+    if all(merge.same_index(windows)):
+        joined = merge.assemble(windows, None, windows[0].index)
+    else:
+        logger.debug("Indices are not aligned, joining on index values")
+        aligned = merge.outer_merge(windows)
+        joined = aligned.value if aligned.is_just() else pd.concat(windows,axis=1)
+    logger.info("Joined %s dataframes in %s seconds",len(dataframes),secdelta(mark))
 
-        logger.debug("Getting bounds")
-        first = df.index[0]
-        logger.debug("Got first (%s)",secdelta(mark))
-        last = df.index[-1]
-        logger.debug("Got last (%s)",secdelta(mark))
-        this_start,this_end = (t for t,_ in (first,last))
-        logger.debug("Got bounds (%s)",secdelta(mark))
+    return joined
 
-        start = max(start,this_start)
-        end = min(end,this_end)
+def time_bounds(dataframe: pd.DataFrame)-> Optional[Tuple[int,int]]:
+    """
+    The first and last TIME values of a TIME-UNIT indexed dataframe, or None
+    if it is empty. Only looks at the distinct TIME values that occur.
+    """
+    if len(dataframe) == 0:
+        return None
+    values,codes = time_codes(dataframe.index)
+    present = values[np.bincount(codes[codes >= 0], minlength = len(values)) > 0]
+    return present.min(),present.max()
 
-    dataframes = [df.loc[start:end,:] for df in dataframes]
-    logger.debug("Subset dataframes (%s)",secdelta(mark))
+def time_codes(index: pd.Index)-> Tuple[np.ndarray,np.ndarray]:
+    """
+    The distinct values of the TIME level of an index, and the position of
+    each row's TIME among them.
+    """
+    if isinstance(index, pd.MultiIndex):
+        return index.levels[0].to_numpy(), index.codes[0]
+    return np.unique(index.get_level_values(0).to_numpy(), return_inverse = True)
 
-    joined = pd.concat(dataframes,axis=1)
-    logger.info("Joined %s dataframes in %s seconds",len(dataframes),secdelta(mark))
+def time_window(dataframe: pd.DataFrame, start: Optional[int], end: Optional[int])-> pd.DataFrame:
+    """
+    Subsets a TIME-UNIT indexed dataframe to the (inclusive) window of TIME
+    values from start to end, where a bound that is None is open.
 
-    return joined 
+    Works on the codes of the TIME level, which are much smaller than the
+    level values: if they are sorted, the window is found by binary search
+    and returned as a slice, otherwise rows are selected with a mask that is
+    computed once per distinct TIME value. The dataframe is never sorted.
+    """
+    if start is None and end is None:
+        return dataframe
+
+    values, codes = time_codes(dataframe.index)
+
+    in_window = np.ones(len(values), dtype = bool)
+    if start is not None:
+        in_window &= values >= start
+    if end is not None:
+        in_window &= values <= end
+
+    if np.all(values[1:] > values[:-1]) and np.all(codes[1:] >= codes[:-1]):
+        wanted = np.flatnonzero(in_window).astype(codes.dtype)
+        if len(wanted) == 0:
+            return dataframe.iloc[0:0]
+        first = np.searchsorted(codes, wanted[0], side = "left")
+        last = np.searchsorted(codes, wanted[-1], side = "right")
+        return dataframe.iloc[first:last]
+
+    return dataframe[in_window[codes]]
 
 def date_from_base(from_date:Optional[date],base)->int:
-    if from_date:
-        d = relativedelta(from_date,base)
-        return d.months + (d.years * 12)
-    else:
+    """
+    Number of whole months from base to from_date (a month_id, when base is
+    constants.BASE_DATE), or None if there is no date.
+    """
+    if not from_date:
         return None
+    months = (from_date.year - base.year) * 12 + from_date.month - base.month
+    if months > 0 and from_date.day < base.day:
+        months -= 1
+    elif months < 0 and from_date.day > base.day:
+        months += 1
+    return months
 
-def temp_subset(dataframe:pd.DataFrame,start_date:Optional[date],end_date:Optional[date]):
-    start,end = (date_from_base(date,constants.BASE_DATE) for date in (start_date,end_date))
-    return dataframe.loc[start:end,:]
+def time_id(from_date:Optional[date],loa:Optional[str]=None)->Optional[int]:
+    """
+    The TIME value of a date at a level of analysis: a year_id for yearly
+    levels of analysis, and a month_id otherwise.
+    """
+    if not from_date:
+        return None
+    if compatibility.index_names(loa)[0] == "year_id":
+        return from_date.year
+    return date_from_base(from_date,constants.BASE_DATE)
+
+def temp_subset(dataframe:pd.DataFrame,start_date:Optional[date],end_date:Optional[date],loa:Optional[str]=None):
+    """
+    Subsets a dataframe to the (inclusive) window of dates from start_date to
+    end_date, either of which can be None. See time_window.
+    """
+    return time_window(dataframe,time_id(start_date,loa),time_id(end_date,loa))
@@ -0,0 +1,194 @@
+"""
+pending
+=======
+
+Exposes the PendingTracker class, which keeps track of upstream work that is
+not ready yet (responses with status 202), so that clients don't have to.
+
+Each pending resource is polled in the background with exponential backoff
+until it is ready or fails, and clients can either wait for it (long-poll)
+or get a job id that can be used to check on the work later.
+
+State is kept in memory, per worker process.
+"""
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING = 202
+
+class Job(NamedTuple):
+    """
+    Job
+    ===
+
+    A request that could not be fulfilled yet, and the keys of the pending
+    resources it is waiting for.
+    """
+    queryset_name: str
+    query: str
+    keys: Tuple[str, ...]
+    created: float
+
+class PendingTracker():
+    """
+    PendingTracker
+    ==============
+
+    parameters:
+        interval (float): Seconds before the first poll
+        max_interval (float): Max seconds between polls
+        timeout (float): Seconds after which pending work is given up on (with
+            status 504), and after which finished work and jobs are forgotten.
+    """
+    def __init__(
+            self,
+            interval: float = settings.PENDING_POLL_INTERVAL,
+            max_interval: float = settings.PENDING_POLL_MAX_INTERVAL,
+            timeout: float = settings.PENDING_TIMEOUT):
+        self._interval = interval
+        self._max_interval = max_interval
+        self._timeout = timeout
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._done: Dict[str, Tuple[int, float]] = {}
+        self._jobs: Dict[str, Job] = {}
+
+    def watch(self, key: str, poll: Callable[[], Awaitable[int]]) -> None:
+        """
+        watch
+        =====
+
+        parameters:
+            key (str): Identifies the pending resource
+            poll (Callable[[], Awaitable[int]]): Requests the resource,
+                returning the status code of the response.
+
+        Starts polling the resource, unless it is already being polled. The
+        poll function is responsible for keeping the result of a successful
+        poll (for instance in a cache).
+        """
+        if key in self._tasks:
+            return
+        self._expire()
+        self._done.pop(key, None)
+        self._events[key] = asyncio.Event()
+        self._tasks[key] = asyncio.ensure_future(self._poll(key, poll))
+
+    def status(self, key: str) -> Optional[int]:
+        """
+        202 if the resource is being polled, the status code of the last poll
+        if polling has finished, or None if the resource is not known.
+        """
+        if key in self._tasks:
+            return PENDING
+        done = self._done.get(key)
+        if done is None or time.time() - done[1] > self._timeout:
+            return None
+        return done[0]
+
+    def pending(self, key: str) -> bool:
+        return key in self._tasks
+
+    async def wait(self, keys: Iterable[str], timeout: float) -> None:
+        """
+        Waits until none of the resources are pending, or until timeout.
+        """
+        waits = [asyncio.ensure_future(self._events[k].wait()) for k in set(keys) if k in self._events]
+        if not waits:
+            return
+        _, unfinished = await asyncio.wait(waits, timeout = timeout)
+        for waiting in unfinished:
+            waiting.cancel()
+
+    def register(self, queryset_name: str, query: str, keys: Iterable[str]) -> str:
+        """
+        register
+        ========
+
+        parameters:
+            queryset_name (str)
+            query (str): Query string of the request
+            keys (Iterable[str]): Keys of the resources the request waits for
+        returns:
+            str: Job id
+
+        Identical requests get the same job id.
+        """
+        job_id = hashlib.sha256(f"{queryset_name}?{query}".encode()).hexdigest()[:16]
+        self._jobs[job_id] = Job(queryset_name, query, tuple(keys), time.time())
+        return job_id
+
+    def job(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None or time.time() - job.created > self._timeout:
+            return None
+        return job
+
+    def job_status(self, job: Job) -> Dict[str, int]:
+        """
+        Number of the job's resources that are pending, ready, failed or
+        unknown (forgotten, or never polled because they were ready).
+        """
+        counts = {"pending": 0, "ready": 0, "failed": 0, "unknown": 0}
+        for key in job.keys:
+            status = self.status(key)
+            if status is None:
+                counts["unknown"] += 1
+            elif status == PENDING:
+                counts["pending"] += 1
+            elif 200 <= status < 300:
+                counts["ready"] += 1
+            else:
+                counts["failed"] += 1
+        return counts
+
+    def stats(self) -> Dict[str, int]:
+        return {
+                "pending": len(self._tasks),
+                "done":    len(self._done),
+                "jobs":    len(self._jobs),
+            }
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+    async def _poll(self, key: str, poll: Callable[[], Awaitable[int]]) -> None:
+        delay = self._interval
+        deadline = time.monotonic() + self._timeout
+        status = PENDING
+        try:
+            while status == PENDING:
+                if time.monotonic() + delay > deadline:
+                    logger.warning("Gave up on %s after %s seconds", key, self._timeout)
+                    status = 504
+                    break
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self._max_interval)
+                try:
+                    status = await poll()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Failed to poll %s, retrying", key)
+            self._done[key] = (status, time.time())
+            logger.debug("%s finished with status %s", key, status)
+        finally:
+            del self._tasks[key]
+            self._events.pop(key).set()
+
+    def _expire(self) -> None:
+        now = time.time()
+        for key in [k for k, (_, finished) in self._done.items() if now - finished > self._timeout]:
+            del self._done[key]
+        for job_id in [j for j, job in self._jobs.items() if now - job.created > self._timeout]:
+            del self._jobs[job_id]
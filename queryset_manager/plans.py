@@ -0,0 +1,150 @@
+"""
+plans
+=====
+
+Compact, immutable representations of querysets, produced once from the
+ORM models (see models.Queryset.plan) and used on the request path instead
+of them. Plans hold no references to a session, and can be cached and shared
+between threads.
+
+Also exposes the path encoding of operations (operation_path, chain_path),
+which is the only one used for building URLs.
+"""
+import functools
+from urllib.parse import quote
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+PATH_CACHE_SIZE = 2**16
+
+class OperationPlan(NamedTuple):
+    """
+    OperationPlan
+    =============
+
+    An operation, as a namespace ("trf" or "base"), a name and arguments.
+    """
+    namespace: str
+    name: str
+    arguments: Tuple[Union[int, str], ...] = ()
+
+    def path(self) -> str:
+        return operation_path(self)
+
+    def dict(self) -> Dict[str, Any]:
+        return {
+            "namespace": self.namespace,
+            "name":      self.name,
+            "arguments": list(self.arguments),
+            }
+
+Chain = Tuple[OperationPlan, ...]
+
+def escape(argument: Union[int, str]) -> str:
+    """
+    An argument as (part of) a path segment. Everything but letters, digits
+    and _.-~ is percent-encoded, so that arguments cannot add segments, or
+    end the path.
+    """
+    return quote(str(argument), safe = "")
+
+@functools.lru_cache(maxsize = PATH_CACHE_SIZE)
+def operation_path(operation: OperationPlan) -> str:
+    """
+    operation_path
+    ==============
+
+    parameters:
+        operation (OperationPlan)
+    returns:
+        str: namespace/name/arguments, with arguments separated by "__", and
+            "_" standing in for no arguments.
+    """
+    arguments = "__".join([escape(a) for a in operation.arguments]) if operation.arguments else "_"
+    return f"{operation.namespace}/{operation.name}/{arguments}"
+
+@functools.lru_cache(maxsize = PATH_CACHE_SIZE)
+def chain_path(chain: Chain) -> str:
+    """
+    The paths of the operations of a chain, joined. Chains shared by several
+    querysets are only encoded once.
+    """
+    return "/".join([operation_path(op) for op in chain])
+
+class QuerysetPlan():
+    """
+    QuerysetPlan
+    ============
+
+    parameters:
+        name (str)
+        loa (str): Level of analysis
+        description (Optional[str])
+        themes (Tuple[str, ...]): Names of the themes of the queryset
+        chains (Tuple[Chain, ...]): Operation chains, each a tuple of
+            operations starting with the root.
+        columns (Tuple[str, ...]): Name of the column produced by each chain
+        fingerprint (str): See models.Queryset.fingerprint
+
+    Has the same methods as models.Queryset for getting paths, columns and
+    definitions, which are worked out once when the plan is created. Plans
+    cannot be modified.
+    """
+    __slots__ = ("name", "loa", "description", "themes", "chains", "columns", "_fingerprint", "_chain_paths", "_paths")
+
+    def __init__(self,
+            name: str,
+            loa: str,
+            description: Optional[str],
+            themes: Tuple[str, ...],
+            chains: Tuple[Chain, ...],
+            columns: Tuple[str, ...],
+            fingerprint: str):
+        chain_paths = tuple(chain_path(chain) for chain in chains)
+        paths = tuple(f"{loa}/{path}" for path in chain_paths)
+        values = (name, loa, description, themes, chains, columns, fingerprint, chain_paths, paths)
+        for attribute, value in zip(self.__slots__, values):
+            object.__setattr__(self, attribute, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} cannot be modified")
+
+    def fingerprint(self) -> str:
+        return self._fingerprint
+
+    def column_names(self) -> List[str]:
+        return list(self.columns)
+
+    def op_chains(self, columns: Optional[Iterable[str]] = None) -> List[Chain]:
+        """
+        The operation chains of the queryset, or only those producing the
+        named columns.
+        """
+        return [self.chains[i] for i in self._selected(columns)]
+
+    def paths(self, columns: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Paths of the chains (or of those producing the named columns), under
+        the level of analysis.
+        """
+        return [self._paths[i] for i in self._selected(columns)]
+
+    def chain_paths(self, columns: Optional[Iterable[str]] = None) -> List[str]:
+        return [self._chain_paths[i] for i in self._selected(columns)]
+
+    def dict(self, columns: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        return {
+            "name":        self.name,
+            "loa":         self.loa,
+            "description": self.description,
+            "themes":      list(self.themes),
+            "operations":  [[op.dict() for op in ch] for ch in self.op_chains(columns)]
+        }
+
+    def _selected(self, columns: Optional[Iterable[str]]) -> Iterable[int]:
+        if columns is None:
+            return range(len(self.chains))
+        columns = set(columns)
+        return [i for i, column in enumerate(self.columns) if column in columns]
+
+    def __repr__(self):
+        return f"QuerysetPlan(name={self.name}, loa={self.loa}, {len(self.chains)} chains)"
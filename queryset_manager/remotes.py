@@ -3,28 +3,51 @@ Operations that access remote services.
 """
 import os
 import logging
-from typing import Optional
-from io import BytesIO
+from typing import Callable, Iterable, List, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
 import pandas as pd
+import pyarrow as pa
 import requests
+import requests.adapters
 from requests.exceptions import HTTPError
 
-from . import models
+from . import plans
 from . import ops
+from . import settings
+from . import tables
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 class OperationPending(Exception):
     pass
 
 class Api():
-    def __init__(self,source_url):
+    """
+    Api
+    ===
+
+    parameters:
+        source_url (str): URL of the data service
+        parallelism (int): Max number of requests in flight at once
+
+    Requests for the paths of a queryset are made concurrently, from a pool of
+    threads sharing a pooled requests.Session.
+    """
+    def __init__(self,source_url,parallelism:int=settings.REMOTE_PARALLELISM):
         self.source_url = source_url
-
-    def fetch_data_for_queryset(self, queryset: models.Queryset,
-            start_date:Optional[date]=None,end_date:Optional[date]=None)->pd.DataFrame:
+        self.parallelism = parallelism
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=parallelism,pool_maxsize=parallelism)
+        self.session.mount("http://",adapter)
+        self.session.mount("https://",adapter)
+
+    def fetch_data_for_queryset(self, queryset: plans.QuerysetPlan,
+            start_date:Optional[date]=None,end_date:Optional[date]=None,
+            columns:Optional[Iterable[str]]=None)->pd.DataFrame:
         """
         Retrieves data corresponding to a queryset with subsetting, if it is ready (cached).
         """
@@ -34,10 +57,10 @@ class Api():
         except AssertionError as ae:
             raise OperationPending from ae
 
-        dataset = self.retrieve_data(queryset,start_date,end_date)
+        dataset = self.retrieve_data(queryset,start_date,end_date,columns)
         return dataset
 
-    def prime_queryset(self, queryset: models.Queryset)->bool:
+    def prime_queryset(self, queryset: plans.QuerysetPlan)->bool:
         """
         Primes a queryset, touching all resources needed for fullfilment.
 
@@ -46,10 +69,10 @@ class Api():
         else.
         """
 
+        touch = lambda path: self.session.get(os.path.join(self.source_url,path)+"?touch=true")
+
         ready = True
-        for path in queryset.paths():
-            url = os.path.join(self.source_url,path)+"?touch=true"
-            response = requests.get(url)
+        for response in self._map(touch,queryset.paths()):
             if response.status_code == 202:
                 ready &= False
             elif response.status_code == 200:
@@ -58,36 +81,49 @@ class Api():
                 raise HTTPError(response=response)
         return ready
 
-    def retrieve_data(self, queryset: models.Queryset,
-            start_date:Optional[date]=None,end_date:Optional[date]=None)->pd.DataFrame:
+    def retrieve_data(self, queryset: plans.QuerysetPlan,
+            start_date:Optional[date]=None,end_date:Optional[date]=None,
+            columns:Optional[Iterable[str]]=None)->pd.DataFrame:
+        """
+        Retrieves and joins the data for (the selected columns of) a queryset.
+        Rows outside of the date window are filtered out as the data is read.
+        """
 
-        dataset = None
         logger.info("Retrieving data for queryset %s",queryset.name)
+        loa = queryset.loa
+        start,end = (ops.time_id(d,loa) for d in (start_date,end_date))
 
-        for path in queryset.paths():
+        def fetch(path):
             url = os.path.join(self.source_url, path)
             logger.debug("Fetching %s",url)
-            response = requests.get(url)
-
-            if response.status_code == 200:
-                try:
-                    data = pd.read_parquet(BytesIO(response.content))
-                except OSError as ose:
-                    logger.error("Failed to deserialize data from %s",path)
-                    raise ose
-
-                if start_date or end_date:
-                    data = ops.temp_subset(data,start_date,end_date)
+            response = self.session.get(url)
 
-                if dataset is not None:
-                    logger.info("Joining data with %s",path)
-                    dataset = ops.join(dataset,data)
+            if response.status_code != 200:
+                raise requests.HTTPError(response=response)
 
-                else:
-                    dataset = data
+            try:
+                return tables.read_parquet(response.content,start,end).to_pandas()
+            except (OSError, pa.ArrowException) as err:
+                logger.error("Failed to deserialize data from %s",path)
+                raise err
 
-            else:
-                raise requests.HTTPError(response=response)
+        data = self._map(fetch,queryset.paths(columns))
+        if not data:
+            return None
 
-        return dataset
+        logger.info("Joining data for %s columns",len(data))
+        return ops.join(*data)
 
+    def _map(self, function: Callable[[str],T], paths: List[str])->List[T]:
+        """
+        Calls function for each path concurrently, returning the results in
+        order. Raises the first exception in order, cancelling calls that
+        have not started yet.
+        """
+        with ThreadPoolExecutor(max(1,min(self.parallelism,len(paths)))) as executor:
+            futures = [executor.submit(function,path) for path in paths]
+            try:
+                return [future.result() for future in futures]
+            finally:
+                for future in futures:
+                    future.cancel()
@@ -1,9 +1,13 @@
 import io
+from typing import Optional, Sequence
 import aiohttp
 import pandas as pd
+import pyarrow as pa
 from pymonad.maybe import Just, Nothing, Maybe
 from views_schema import viewser as schema
 
+from . import tables
+
 class ResponseResult():
     def __init__(self, status_code, content):
         self.content = content
@@ -38,18 +42,41 @@ class ResponseResult():
         Maybe a pandas dataframe, if deserializable.
         """
         if self.status_code == 200:
-            return self._pd_from_bytes(self.content)
+            return dataframe_from_bytes(self.content)
         else:
             return Nothing
 
-    def _pd_from_bytes(self, data: bytes) -> Maybe[pd.DataFrame]:
-        try:
-            return Just(pd.read_parquet(io.BytesIO(data)))
-        except Exception:
-            return Nothing
-
     def __str__(self):
         return f"ResponseResult(status_code = {self.status_code}, content = \"{self.content}\")"
 
     def __repr__(self):
         return str(self)
+
+def dataframe_from_bytes(
+        data: bytes,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        units: Optional[Sequence[int]] = None) -> Maybe[pd.DataFrame]:
+    """
+    Maybe a pandas dataframe, read from parquet bytes with the rows outside
+    of the TIME window and units filtered out (see tables.read_parquet).
+    """
+    try:
+        if not start and not end and units is None:
+            return Just(pd.read_parquet(io.BytesIO(data)))
+        return Just(tables.read_parquet(data, start, end, units).to_pandas())
+    except Exception:
+        return Nothing
+
+def table_from_bytes(
+        data: bytes,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        units: Optional[Sequence[int]] = None) -> Maybe[pa.Table]:
+    """
+    Arrow counterpart of dataframe_from_bytes.
+    """
+    try:
+        return Just(tables.read_parquet(data, start, end, units))
+    except Exception:
+        return Nothing
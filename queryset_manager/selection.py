@@ -0,0 +1,68 @@
+"""
+selection
+=========
+
+Which part of a queryset's data is asked for, beyond its time window: a
+subset of its columns, and of its units. Columns are selected by pruning
+operation chains before they are fetched, and units by filtering rows as
+parquet is read.
+"""
+import json
+import hashlib
+from typing import NamedTuple, Optional, Tuple
+
+class Selection(NamedTuple):
+    """
+    Selection
+    =========
+
+    Column names and unit ids to keep. None means all.
+    """
+    columns: Optional[Tuple[str, ...]] = None
+    units: Optional[Tuple[int, ...]] = None
+
+    @classmethod
+    def parse(cls, columns: Optional[str] = None, units: Optional[str] = None) -> "Selection":
+        """
+        parse
+        =====
+
+        parameters:
+            columns (Optional[str]): Comma separated column names
+            units (Optional[str]): Comma separated unit ids
+        returns:
+            Selection
+
+        Raises ValueError if units are not integers.
+        """
+        if columns is not None:
+            columns = tuple(dict.fromkeys(c.strip() for c in columns.split(",") if c.strip()))
+        if units is not None:
+            try:
+                units = tuple(sorted({int(u) for u in units.split(",") if u.strip()}))
+            except ValueError as ve:
+                raise ValueError(f"Units must be comma separated integers, not {units}") from ve
+        return cls(columns or None, units or None)
+
+    @property
+    def everything(self) -> bool:
+        return self.columns is None and self.units is None
+
+    @property
+    def key(self) -> str:
+        """
+        A short digest of the selection, for cache keys.
+        """
+        if self.everything:
+            return "all"
+        definition = json.dumps({"columns": self.columns, "units": self.units})
+        return hashlib.sha256(definition.encode()).hexdigest()[:16]
+
+    def unknown_columns(self, queryset) -> Tuple[str, ...]:
+        """
+        Selected columns that the queryset does not have.
+        """
+        if self.columns is None:
+            return ()
+        known = set(queryset.column_names())
+        return tuple(c for c in self.columns if c not in known)
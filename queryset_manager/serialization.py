@@ -0,0 +1,260 @@
+"""
+serialization
+=============
+
+Choice of how data responses are encoded, negotiated per request: the wire
+format (parquet, Arrow IPC stream or Feather), and its compression.
+"""
+import io
+import enum
+from typing import NamedTuple, Optional, Sequence
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from . import settings
+from . import tables
+
+CODECS = ("none", "snappy", "gzip", "brotli", "zstd", "lz4")
+
+class Format(enum.Enum):
+    """
+    Wire formats for data responses.
+    """
+    parquet="parquet"
+    arrow="arrow"
+    feather="feather"
+
+MEDIA_TYPES = {
+        Format.parquet: "application/vnd.apache.parquet",
+        Format.arrow:   "application/vnd.apache.arrow.stream",
+        Format.feather: "application/vnd.apache.arrow.file",
+    }
+
+ACCEPTED_MEDIA_TYPES = {
+        **{media_type: format for format, media_type in MEDIA_TYPES.items()},
+        "application/octet-stream": Format.parquet,
+        "application/x-parquet":    Format.parquet,
+        "application/x-feather":    Format.feather,
+        "*/*":                      Format.parquet,
+    }
+
+ARROW_CODECS = ("none", "lz4", "zstd")
+
+COMPRESSION_LEVELS = {
+        "gzip":   (1, 9),
+        "brotli": (0, 11),
+        "zstd":   (1, 22),
+        "lz4":    (1, 12),
+    }
+
+class Compression(NamedTuple):
+    """
+    Compression
+    ===========
+
+    A compression codec, with an optional codec-specific level.
+    """
+    codec: str = "gzip"
+    level: Optional[int] = None
+
+    @classmethod
+    def parse(cls, codec: str, level: Optional[int] = None) -> "Compression":
+        """
+        Raises ValueError for unknown codecs, and for levels that are out of
+        the range of the codec (see COMPRESSION_LEVELS), or given for a codec
+        without levels.
+        """
+        codec = codec.strip().lower()
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression \"{codec}\", expected one of {', '.join(CODECS)}")
+        if level is not None:
+            if codec not in COMPRESSION_LEVELS:
+                raise ValueError(f"Compression \"{codec}\" does not take a level")
+            lowest, highest = COMPRESSION_LEVELS[codec]
+            if not lowest <= level <= highest:
+                raise ValueError(f"Compression level for {codec} must be between {lowest} and {highest}, not {level}")
+        return cls(codec, level)
+
+    @property
+    def key(self) -> str:
+        return self.codec if self.level is None else f"{self.codec}{self.level}"
+
+    @property
+    def parquet_arguments(self):
+        """
+        Keyword arguments for pyarrow.parquet.write_table and DataFrame.to_parquet.
+        """
+        arguments = {"compression": None if self.codec == "none" else self.codec}
+        if self.level is not None:
+            arguments["compression_level"] = self.level
+        return arguments
+
+    @property
+    def arrow_codec(self) -> Optional[str]:
+        return None if self.codec == "none" else self.codec
+
+DEFAULT_COMPRESSION = Compression.parse(settings.DATA_COMPRESSION, settings.DATA_COMPRESSION_LEVEL)
+
+class Encoding(NamedTuple):
+    """
+    Encoding
+    ========
+
+    A wire format and its compression. A compression of None means that no
+    compression was asked for, see with_defaults.
+    """
+    format: Format = Format.parquet
+    compression: Optional[Compression] = None
+
+    @property
+    def key(self) -> str:
+        compression = self.compression.key if self.compression else "default"
+        return f"{self.format.value}-{compression}"
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    def with_defaults(self) -> "Encoding":
+        """
+        Fills in the default compression for the format: DEFAULT_COMPRESSION
+        for parquet, and no compression for the Arrow formats, which are meant
+        to be cheap to read.
+        """
+        if self.compression is not None:
+            return self
+        if self.format is Format.parquet:
+            return Encoding(self.format, DEFAULT_COMPRESSION)
+        return Encoding(self.format, Compression("none"))
+
+def accepted_media_type(accept: Optional[str]):
+    """
+    The media type in an Accept header that can be produced and has the
+    highest quality (q), the first one listed among equals, and its other
+    parameters as a dict. Types with a quality of 0 are not accepted.
+    Returns None and no parameters if there is no Accept header, or if none
+    of its types can be produced, so that the default format is used.
+    """
+    if not accept:
+        return None, {}
+
+    best, best_quality = (None, {}), 0.0
+    for entry in accept.split(","):
+        media_type, *parameters = entry.split(";")
+        media_type = media_type.strip().lower()
+        if media_type not in ACCEPTED_MEDIA_TYPES:
+            continue
+        parameters = {k.strip().lower(): v.strip().strip('"') for k, _, v in (p.partition("=") for p in parameters)}
+        try:
+            quality = float(parameters.pop("q", 1))
+        except ValueError:
+            continue
+        if quality > best_quality:
+            best, best_quality = (media_type, parameters), quality
+    return best
+
+def negotiate(
+        accept: Optional[str] = None,
+        format: Optional[str] = None,
+        compression: Optional[str] = None,
+        level: Optional[int] = None) -> Encoding:
+    """
+    negotiate
+    =========
+
+    parameters:
+        accept (Optional[str]): Accept header, for instance
+            "application/vnd.apache.arrow.stream; compression=zstd"
+        format (Optional[str]): Format passed as query parameter
+        compression (Optional[str]): Codec passed as query parameter
+        level (Optional[int]): Level passed as query parameter
+    returns:
+        Encoding
+
+    Query parameters take precedence over the Accept header. Without either,
+    the encoding is parquet, with no compression requested, as it is if no
+    media type in the Accept header can be produced. Raises ValueError if
+    the requested encoding is not valid, including a level without a codec.
+    """
+    media_type, parameters = accepted_media_type(accept) if format is None else (None, {})
+
+    if format is not None:
+        try:
+            chosen_format = Format(format.strip().lower())
+        except ValueError as ve:
+            raise ValueError(
+                    f"Unknown format \"{format}\", expected one of {', '.join(f.value for f in Format)}"
+                    ) from ve
+    elif media_type is not None:
+        chosen_format = ACCEPTED_MEDIA_TYPES[media_type]
+    else:
+        chosen_format = Format.parquet
+
+    if compression is None:
+        compression = parameters.get("compression")
+        if level is None and "level" in parameters:
+            try:
+                level = int(parameters["level"])
+            except ValueError as ve:
+                raise ValueError(f"Compression level must be an integer, not {parameters['level']}") from ve
+
+    if compression is None:
+        if level is not None:
+            raise ValueError("A compression level requires a compression codec")
+        return Encoding(chosen_format)
+
+    chosen_compression = Compression.parse(compression, level)
+    if chosen_format is not Format.parquet and chosen_compression.codec not in ARROW_CODECS:
+        raise ValueError(
+                f"Compression \"{chosen_compression.codec}\" is not available for {chosen_format.value}, "
+                f"expected one of {', '.join(ARROW_CODECS)}")
+    return Encoding(chosen_format, chosen_compression)
+
+def serialize_table(table: pa.Table, encoding: Encoding) -> bytes:
+    """
+    serialize_table
+    ===============
+
+    parameters:
+        table (pyarrow.Table)
+        encoding (Encoding)
+    returns:
+        bytes
+
+    Writes a table in the requested format. Arrow IPC streams are written as
+    a series of record batches of at most ARROW_BATCH_SIZE rows.
+    """
+    encoding = encoding.with_defaults()
+    buffer = io.BytesIO()
+
+    if encoding.format is Format.parquet:
+        pq.write_table(table, buffer, **encoding.compression.parquet_arguments)
+
+    elif encoding.format is Format.feather:
+        feather.write_feather(
+                table, buffer,
+                compression       = encoding.compression.arrow_codec or "uncompressed",
+                compression_level = encoding.compression.level)
+
+    else:
+        options = pa.ipc.IpcWriteOptions(compression = ipc_codec(encoding.compression))
+        with pa.ipc.new_stream(buffer, table.schema, options = options) as writer:
+            for batch in table.to_batches(max_chunksize = settings.ARROW_BATCH_SIZE):
+                writer.write_batch(batch)
+
+    return buffer.getvalue()
+
+def ipc_codec(compression: Compression):
+    if compression.arrow_codec is None:
+        return None
+    if compression.level is None:
+        return compression.arrow_codec
+    return pa.Codec(compression.arrow_codec, compression_level = compression.level)
+
+def transcode(data: bytes, encoding: Encoding, units: Optional[Sequence[int]] = None) -> bytes:
+    """
+    Rewrites parquet bytes in another encoding, keeping only the rows of the
+    given units, if any.
+    """
+    return serialize_table(tables.read_parquet(data, units = units), encoding)
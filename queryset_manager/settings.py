@@ -1,5 +1,8 @@
+import os
+import tempfile
 from typing import Optional
 import environs
+from marshmallow.validate import OneOf
 
 env = environs.Env()
 env.read_env()
@@ -11,7 +14,55 @@ DB_USER                    = env.str("QUERYSET_MANAGER_DB_USER", "jim")
 DB_SCHEMA: Optional[str]   = env.str("QUERYSET_MANAGER_DB_SCHEMA", None)
 DB_PASSWORD: Optional[str] = env.str("QUERYSET_MANAGER_DB_PASSWORD", None)
 DB_SSL                     = env.str("QUERYSET_MANAGER_DB_SSL", "allow")
+DB_POOL_SIZE               = env.int("QUERYSET_MANAGER_DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW            = env.int("QUERYSET_MANAGER_DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT            = env.float("QUERYSET_MANAGER_DB_POOL_TIMEOUT", 30)
+DB_POOL_RECYCLE            = env.int("QUERYSET_MANAGER_DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING           = env.bool("QUERYSET_MANAGER_DB_POOL_PRE_PING", True)
 
 LOG_LEVEL                  = env.str("LOG_LEVEL", "WARNING")
 
 DATA_SERVICE_URL           = env.str("DATA_SERVICE_URL", "http://data-service")
+
+DATA_ASSEMBLY              = env.str("DATA_ASSEMBLY", "remote", validate = OneOf(["remote", "local"]))
+DATA_STREAMING             = env.bool("DATA_STREAMING", True)
+STREAM_CHUNK_SIZE          = env.int("STREAM_CHUNK_SIZE", 2**20)
+
+RETRIEVER_CONCURRENCY      = env.int("RETRIEVER_CONCURRENCY", 16)
+RETRIEVER_MAX_CONCURRENCY  = env.int("RETRIEVER_MAX_CONCURRENCY", 64)
+REMOTE_PARALLELISM         = env.int("REMOTE_PARALLELISM", 16)
+MERGE_ENGINE               = env.str("MERGE_ENGINE", "pandas", validate = OneOf(["pandas", "columnar"]))
+DATA_PIPELINE              = env.str("DATA_PIPELINE", "pandas", validate = OneOf(["pandas", "arrow"]))
+DATA_COMPRESSION           = env.str("DATA_COMPRESSION", "gzip")
+DATA_COMPRESSION_LEVEL: Optional[int] = env.int("DATA_COMPRESSION_LEVEL", None)
+ARROW_BATCH_SIZE           = env.int("ARROW_BATCH_SIZE", 2**16)
+
+WORKER_THREADS             = env.int("WORKER_THREADS", min(32, (os.cpu_count() or 1) + 4))
+DECODE_PROCESSES           = env.int("DECODE_PROCESSES", 0)
+
+PENDING_POLL_INTERVAL      = env.float("PENDING_POLL_INTERVAL", 1)
+PENDING_POLL_MAX_INTERVAL  = env.float("PENDING_POLL_MAX_INTERVAL", 30)
+PENDING_TIMEOUT            = env.float("PENDING_TIMEOUT", 3600)
+PENDING_MAX_WAIT           = env.float("PENDING_MAX_WAIT", 60)
+
+WARMUP_CONCURRENCY         = env.int("WARMUP_CONCURRENCY", 4)
+WARMUP_THEMES              = env.list("WARMUP_THEMES", [])
+WARMUP_INTERVAL            = env.float("WARMUP_INTERVAL", 86400)
+
+HTTP_POOL_SIZE             = env.int("HTTP_POOL_SIZE", 100)
+HTTP_KEEPALIVE_TIMEOUT     = env.float("HTTP_KEEPALIVE_TIMEOUT", 30)
+HTTP_TIMEOUT: Optional[float] = env.float("HTTP_TIMEOUT", None)
+
+RESULT_CACHE_DIR           = env.str("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "queryset-manager", "results"))
+RESULT_CACHE_SIZE          = env.int("RESULT_CACHE_SIZE", 2**31)
+RESULT_CACHE_TTL: Optional[float] = env.float("RESULT_CACHE_TTL", 24*60*60)
+
+COLUMN_CACHE_DIR           = env.str("COLUMN_CACHE_DIR", os.path.join(tempfile.gettempdir(), "queryset-manager", "columns"))
+COLUMN_CACHE_SIZE          = env.int("COLUMN_CACHE_SIZE", 2**33)
+COLUMN_CACHE_TTL: Optional[float] = env.float("COLUMN_CACHE_TTL", 24*60*60)
+
+QUERYSET_CACHE_SIZE        = env.int("QUERYSET_CACHE_SIZE", 1024)
+QUERYSET_CACHE_TTL: Optional[float] = env.float("QUERYSET_CACHE_TTL", 60)
+QUERYSET_CACHE_NOTIFY      = env.bool("QUERYSET_CACHE_NOTIFY", False)
+
+LISTING_PAGE_SIZE          = env.int("LISTING_PAGE_SIZE", 1000)
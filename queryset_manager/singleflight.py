@@ -0,0 +1,48 @@
+"""
+singleflight
+============
+
+Exposes the SingleFlight class, which is used to coalesce concurrent calls
+doing the same work into a single call.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+class SingleFlight():
+    """
+    SingleFlight
+    ============
+
+    Keeps track of in-flight calls by key. A caller asking for a key that is
+    already in flight awaits the running call and shares its result (or
+    exception), instead of starting a new one.
+
+    The shared call is shielded from cancellation, so that one caller going
+    away does not cancel the work for the others.
+    """
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, function: Callable[..., Awaitable[T]], *args: Any) -> T:
+        """
+        do
+        ==
+
+        parameters:
+            key (Hashable): Identifies the work
+            function (Callable[..., Awaitable[T]])
+            *args: Passed to function, if it is called
+        returns:
+            T
+        """
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(function(*args))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._in_flight
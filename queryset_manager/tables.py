@@ -0,0 +1,294 @@
+"""
+tables
+======
+
+Arrow-native counterparts of the functions in merge and ops, that work on
+pyarrow Tables read from parquet written by pandas, without converting the
+data to pandas objects.
+
+The (TIME, UNIT) index of a table is found through the pandas metadata that
+pandas writes along with the data, and the same metadata is written for
+results, so that they read back into pandas with the right index.
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pymonad.maybe import Maybe, Nothing, Just
+
+from . import merge
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_INDEX_NAMES = ("TIME", "UNIT")
+
+def index_columns(table: pa.Table)-> Optional[Tuple[str, str]]:
+    """
+    index_columns
+    =============
+
+    parameters:
+        table (pyarrow.Table)
+    returns:
+        Optional[Tuple[str, str]]: Field names of the TIME and UNIT columns
+
+    Returns None if the table does not have a two-level, integer index.
+    """
+    return schema_index_columns(table.schema)
+
+def schema_index_columns(schema: pa.Schema)-> Optional[Tuple[str, str]]:
+    metadata = schema.pandas_metadata
+    if metadata is None:
+        return None
+    columns = metadata.get("index_columns", [])
+    if len(columns) != 2 or not all(isinstance(c, str) for c in columns):
+        return None
+    if not all(c in schema.names and pa.types.is_integer(schema.field(c).type) for c in columns):
+        return None
+    return tuple(columns)
+
+def fallback_index_columns(schema: pa.Schema)-> Optional[Tuple[str, str]]:
+    """
+    Field names of the TIME and UNIT columns of files without pandas index
+    metadata: the integer fields named TIME and UNIT (in any case), or else
+    the first two integer fields. None if there are fewer than two.
+    """
+    integers = [f.name for f in schema if pa.types.is_integer(f.type)]
+    by_name = {name.upper(): name for name in integers}
+    if all(name in by_name for name in FALLBACK_INDEX_NAMES):
+        return tuple(by_name[name] for name in FALLBACK_INDEX_NAMES)
+    if len(integers) < 2:
+        return None
+    return tuple(integers[:2])
+
+def read_parquet(
+        data: bytes,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        units: Optional[Sequence[int]] = None)-> pa.Table:
+    """
+    read_parquet
+    ============
+
+    parameters:
+        data (bytes): Parquet written by pandas
+        start (Optional[int]): First TIME value to read
+        end (Optional[int]): Last TIME value to read
+        units (Optional[Sequence[int]]): UNIT values to read
+    returns:
+        pyarrow.Table
+
+    Reads only the rows within the TIME window (None or 0 meaning open) and
+    with the given UNIT values. The filters are checked against row group
+    statistics, so that row groups without any matching rows are skipped
+    without being decoded.
+
+    Files without a (TIME, UNIT) index in their pandas metadata are read
+    whole, and filtered after decoding on the columns found by
+    fallback_index_columns. Raises ValueError if there are no such columns.
+    """
+    source = pa.BufferReader(data)
+    if not (start or end or units is not None):
+        return pq.read_table(source)
+
+    schema = pq.read_schema(source)
+    filters = parquet_filters(schema, start, end, units)
+    if filters is not None:
+        return pq.read_table(source, filters = filters)
+
+    index = fallback_index_columns(schema)
+    if index is None:
+        raise ValueError("Cannot filter parquet without integer TIME and UNIT columns")
+    return filter_rows(pq.read_table(source), index, start, end, units)
+
+def filter_rows(
+        table: pa.Table,
+        index: Tuple[str, str],
+        start: Optional[int],
+        end: Optional[int],
+        units: Optional[Sequence[int]])-> pa.Table:
+    """
+    The rows of a table within the TIME window and with the given UNIT
+    values, selected on the named (TIME, UNIT) columns.
+    """
+    time, unit = index
+    mask = np.ones(len(table), dtype = bool)
+    if start:
+        mask &= column_values(table, time) >= start
+    if end:
+        mask &= column_values(table, time) <= end
+    if units is not None:
+        mask &= np.isin(column_values(table, unit), np.asarray(list(units), dtype = np.int64))
+    return table.filter(pa.array(mask))
+
+def parquet_filters(schema: pa.Schema, start: Optional[int], end: Optional[int], units: Optional[Sequence[int]]):
+    """
+    Filters for pyarrow.parquet.read_table selecting a TIME window and a set
+    of UNITs, or None if there is nothing to filter by.
+    """
+    index = schema_index_columns(schema)
+    if index is None:
+        return None
+
+    time, unit = index
+    filters = []
+    if start:
+        filters.append((time, ">=", start))
+    if end:
+        filters.append((time, "<=", end))
+    if units is not None:
+        filters.append((unit, "in", list(units)))
+    return filters or None
+
+def arrow_merge(tables: List[pa.Table])-> Maybe[pa.Table]:
+    """
+    arrow_merge
+    ===========
+
+    parameters:
+        tables (List[pyarrow.Table])
+    returns:
+        Maybe[pyarrow.Table]
+
+    Inner merges tables on their (TIME, UNIT) indices, like merge.merge does
+    for dataframes: value columns are put side by side in order, duplicate
+    column names are disambiguated, and the result has the index names of
+    the first table that has any. Like merge.IncrementalMerge, rows are
+    sorted by index. Tables sharing the index of the first table are not
+    looked up.
+
+    Returns Nothing if any table does not have an integer (TIME, UNIT) index
+    with unique values.
+    """
+    if not tables:
+        return Nothing
+
+    indices = [index_columns(table) for table in tables]
+    if any(index is None for index in indices):
+        return Nothing
+
+    levels = [tuple(column_values(table, name) for name in index) for table, index in zip(tables, indices)]
+    first_time, first_unit = levels[0]
+    same = [
+            len(time) == len(first_time) and np.array_equal(time, first_time) and np.array_equal(unit, first_unit)
+            for time, unit in levels
+        ]
+    different = [l for l, s in zip(levels, same) if not s]
+
+    keys = merge.level_keys([levels[0]] + different)
+    if keys is None or not all(is_unique(k) for k in keys):
+        return Nothing
+
+    first, *rest = keys
+    found = np.ones(len(first), dtype = bool)
+    lookups = []
+    for other in rest:
+        rows = merge.lookup(other, first)
+        found &= rows >= 0
+        lookups.append(rows)
+
+    lookups = iter(lookups)
+    if found.all():
+        rows = None
+        positions = [None if s else next(lookups) for s in same]
+    else:
+        rows = np.flatnonzero(found)
+        positions = [rows if s else next(lookups)[rows] for s in same]
+
+    result_keys = first if rows is None else first[rows]
+    if not np.all(result_keys[1:] > result_keys[:-1]):
+        order = np.argsort(result_keys, kind = "stable")
+        rows = order if rows is None else rows[order]
+        positions = [order if p is None else p[order] for p in positions]
+
+    return Just(assemble(tables, indices, positions, rows))
+
+def assemble(
+        tables: List[pa.Table],
+        indices: List[Tuple[str, str]],
+        positions: List[Optional[np.ndarray]],
+        rows: Optional[np.ndarray])-> pa.Table:
+    """
+    assemble
+    ========
+
+    parameters:
+        tables (List[pyarrow.Table])
+        indices (List[Tuple[str, str]]): Index field names of each table
+        positions (List[Optional[numpy.ndarray]]): Rows to take from each
+            table, None meaning all rows as they are.
+        rows (Optional[numpy.ndarray]): Rows to take from the first table's index
+    returns:
+        pyarrow.Table
+    """
+    index_names = next(
+            (tuple(index_level_names(table)) for table in tables if index_level_names(table) != [None, None]),
+            FALLBACK_INDEX_NAMES)
+
+    value_names = [[f for f in table.schema.names if f not in index] for table, index in zip(tables, indices)]
+    distinct = iter(merge.distinct_names([name for names in value_names for name in names]))
+
+    arrays = []
+    fields = []
+    entries = []
+    for table, names, positions_in_table in zip(tables, value_names, positions):
+        metadata = column_metadata(table)
+        for name in names:
+            column = table.column(name)
+            if positions_in_table is not None:
+                column = column.take(pa.array(positions_in_table))
+            new_name = next(distinct)
+            arrays.append(column)
+            fields.append(pa.field(new_name, column.type))
+            entries.append({**metadata.get(name, {}), "name": new_name, "field_name": new_name})
+
+    first_metadata = column_metadata(tables[0])
+    for field_name, name in zip(indices[0], index_names):
+        column = tables[0].column(field_name)
+        if rows is not None:
+            column = column.take(pa.array(rows))
+        arrays.append(column)
+        fields.append(pa.field(name, column.type))
+        entries.append({**first_metadata.get(field_name, {}), "name": name, "field_name": name})
+
+    pandas_metadata = {
+            **tables[0].schema.pandas_metadata,
+            "index_columns": list(index_names),
+            "columns": entries,
+        }
+    schema = pa.schema(fields, metadata = {b"pandas": json.dumps(pandas_metadata).encode()})
+    return pa.Table.from_arrays(arrays, schema = schema)
+
+def column_values(table: pa.Table, name: str)-> np.ndarray:
+    return table.column(name).to_numpy().astype(np.int64, copy = False)
+
+def column_metadata(table: pa.Table)-> Dict[str, Dict[str, Any]]:
+    return {c["field_name"]: c for c in table.schema.pandas_metadata["columns"]}
+
+def index_level_names(table: pa.Table)-> List[Optional[str]]:
+    metadata = column_metadata(table)
+    return [metadata.get(c, {}).get("name") for c in table.schema.pandas_metadata["index_columns"]]
+
+def is_unique(keys: np.ndarray)-> bool:
+    if np.all(keys[1:] > keys[:-1]):
+        return True
+    return len(np.unique(keys)) == len(keys)
+
+class IncrementalTableMerge():
+    """
+    IncrementalTableMerge
+    =====================
+
+    Arrow counterpart of merge.IncrementalMerge. Tables are kept as they are
+    added, and merged all at once when the result is requested.
+    """
+    def __init__(self):
+        self._tables: Dict[int, pa.Table] = {}
+
+    def add(self, position: int, table: pa.Table) -> None:
+        self._tables[position] = table
+
+    def result(self) -> Maybe[pa.Table]:
+        return arrow_merge([self._tables.pop(p) for p in sorted(self._tables)])
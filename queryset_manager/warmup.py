@@ -0,0 +1,164 @@
+"""
+warmup
+======
+
+Exposes the Warmer class, which fetches the data of querysets ahead of time,
+so that the first request for them is served from cache, and keeps track of
+the progress of each warm-up run.
+"""
+import uuid
+import asyncio
+import logging
+import datetime
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import crud
+from . import data_retriever
+from . import plans
+
+logger = logging.getLogger(__name__)
+
+class WarmupRun():
+    """
+    WarmupRun
+    =========
+
+    parameters:
+        run_id (str)
+        label (str): What is being warmed, for instance "theme/nightly"
+        names (List[str]): Names of the querysets to warm
+
+    Each queryset is either queued, warming, warm, pending (some of its data
+    is pending upstream, and is being polled), failed or missing.
+    """
+    def __init__(self, run_id: str, label: str, names: List[str]):
+        self.run_id = run_id
+        self.label = label
+        self.status: Dict[str, str] = {name: "queued" for name in names}
+        self.started = datetime.datetime.now()
+        self.finished: Optional[datetime.datetime] = None
+
+    def state(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for status in self.status.values():
+            counts[status] = counts.get(status, 0) + 1
+        return {
+                "run_id":    self.run_id,
+                "label":     self.label,
+                "done":      self.finished is not None,
+                "started":   self.started.isoformat(),
+                "finished":  self.finished.isoformat() if self.finished else None,
+                "counts":    counts,
+                "querysets": dict(self.status),
+            }
+
+class Warmer():
+    """
+    Warmer
+    ======
+
+    parameters:
+        retriever (queryset_manager.data_retriever.DataRetriever)
+        session_factory (Callable[[], sqlalchemy.orm.Session]): Opens a
+            database session, used to look up querysets while warming.
+        concurrency (int): Max number of querysets warmed at once, across runs
+        assemble (bool): Whether to also assemble the (default) result of
+            each queryset into the result cache, or only fetch its columns.
+        db_executor (Optional[concurrent.futures.Executor]): Where to look up
+            querysets. Defaults to the event loop's default executor.
+        fetch_result (Optional[Callable[[QuerysetPlan], Awaitable[int]]]):
+            Fetches the result of a queryset that is assembled upstream into
+            the result cache, returning a status code. If set, it is used
+            instead of fetching columns, which are not used for such results.
+
+    Runs are kept in memory, per worker process.
+    """
+
+    MAX_RUNS = 100
+
+    def __init__(self,
+            retriever: data_retriever.DataRetriever,
+            session_factory: Callable[[], Session],
+            concurrency: int = 4,
+            assemble: bool = False,
+            db_executor: Optional[Executor] = None,
+            fetch_result: Optional[Callable[[plans.QuerysetPlan], Awaitable[int]]] = None):
+        self._retriever = retriever
+        self._session_factory = session_factory
+        self._limit = asyncio.Semaphore(concurrency)
+        self._assemble = assemble
+        self._db_executor = db_executor
+        self._fetch_result = fetch_result
+        self._runs: Dict[str, WarmupRun] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self, label: str, names: List[str]) -> WarmupRun:
+        """
+        Starts warming the named querysets in the background.
+        """
+        run = WarmupRun(uuid.uuid4().hex[:16], label, list(dict.fromkeys(names)))
+        self._runs[run.run_id] = run
+        self._tasks[run.run_id] = asyncio.ensure_future(self._run(run))
+        for run_id in list(self._runs)[:-self.MAX_RUNS]:
+            if self._runs[run_id].finished is not None:
+                del self._runs[run_id]
+        return run
+
+    async def wait(self, run: WarmupRun) -> None:
+        task = self._tasks.get(run.run_id)
+        if task is not None:
+            await asyncio.shield(task)
+
+    def run(self, run_id: str) -> Optional[WarmupRun]:
+        return self._runs.get(run_id)
+
+    def runs(self) -> List[WarmupRun]:
+        return list(self._runs.values())
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+    async def _run(self, run: WarmupRun) -> None:
+        logger.info("Warming %s querysets (%s)", len(run.status), run.label)
+        try:
+            await asyncio.gather(*[self._warm(run, name) for name in run.status])
+        finally:
+            run.finished = datetime.datetime.now()
+            del self._tasks[run.run_id]
+        logger.info("Warmed %s: %s", run.label, run.state()["counts"])
+
+    async def _warm(self, run: WarmupRun, name: str) -> None:
+        async with self._limit:
+            run.status[name] = "warming"
+            session = self._session_factory()
+            try:
+                queryset = await asyncio.get_running_loop().run_in_executor(
+                        self._db_executor, crud.get_queryset_plan, session, name)
+                if queryset is None:
+                    run.status[name] = "missing"
+                    return
+
+                if self._fetch_result is not None:
+                    status_code = await self._fetch_result(queryset)
+                else:
+                    status_code = await self._retriever.warm(queryset)
+                    if status_code == 200 and self._assemble:
+                        status_code, _ = await self._retriever.queryset_data_response(queryset)
+            except Exception:
+                logger.exception("Failed to warm %s", name)
+                status_code = 500
+            finally:
+                session.close()
+
+            if status_code == 200:
+                run.status[name] = "warm"
+            elif status_code == 202:
+                run.status[name] = "pending"
+            else:
+                run.status[name] = "failed"
@@ -0,0 +1,232 @@
+import os
+import time
+import json
+import asyncio
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import views_schema
+from queryset_manager import app, cache, db, definitions, models, settings
+from queryset_manager.selection import Selection
+from queryset_manager.serialization import Encoding
+
+def posted(name, columns = 2):
+    return {
+            "name": name,
+            "loa": "priogrid_month",
+            "themes": ["my_theme"],
+            "operations": [
+                [
+                    {"namespace": "trf", "name": "util.rename", "arguments": [f"col_{i}"]},
+                    {"namespace": "base", "name": f"priogrid_month.var_{i}", "arguments": ["values"]},
+                ]
+                for i in range(columns)
+            ]
+        }
+
+def ndjson(*querysets):
+    return "\n".join(json.dumps(qs) for qs in querysets)
+
+class Upstream():
+    """
+    Stands in for an aiohttp.ClientResponse from the data service.
+    """
+    def __init__(self, body: bytes):
+        self.status = 200
+        self.headers = {"Content-Type": "application/vnd.apache.parquet", "Content-Length": str(len(body))}
+        self.content = self
+        self.released = 0
+        self._body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self._body), size):
+            yield self._body[start:start + size]
+
+    def release(self):
+        self.released += 1
+
+    async def read(self):
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        self.release()
+
+class AppTestCase(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args = {"check_same_thread": False}, poolclass = StaticPool)
+        models.Base.metadata.create_all(engine)
+        session = patch.object(db, "Session", sessionmaker(engine))
+        session.start()
+        self.addCleanup(session.stop)
+        definitions.querysets.invalidate()
+
+        self.client = TestClient(app.app)
+        self.client.__enter__()
+        self.addCleanup(self.client.__exit__, None, None, None)
+
+class TestBulk(AppTestCase):
+    def test_create(self):
+        response = self.client.post("/bulk/querysets", json = [posted("a"), posted("b")])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"querysets": ["a", "b"]})
+
+        response = self.client.post("/bulk/querysets",
+                content = ndjson(posted("c"), posted("d")) + "\n\n",
+                headers = {"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"querysets": ["c", "d"]})
+        self.assertEqual(self.client.get("/querysets/d").json()["operations"], posted("d")["operations"])
+
+    def test_conflict(self):
+        self.client.post("/bulk/querysets", json = [posted("a")])
+
+        response = self.client.post("/bulk/querysets", json = [posted("a", 1), posted("b")])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get("/querysets/b").status_code, 404)
+
+        response = self.client.post("/bulk/querysets?overwrite=true", json = [posted("a", 1), posted("b")])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.client.get("/querysets/a").json()["operations"]), 1)
+
+        response = self.client.put("/bulk/querysets", json = [posted("a")])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.client.get("/querysets/a").json()["operations"]), 2)
+
+    def test_invalid(self):
+        invalid_bodies = [
+                ("[{\"name\": \"a\"}]", "application/json"),
+                ("not json", "application/json"),
+                (ndjson(posted("a")) + "\n{", "application/x-ndjson"),
+                (json.dumps([posted("a"), posted("a")]), "application/json"),
+                (json.dumps([{**posted("a"), "operations": [list(reversed(posted("a")["operations"][0]))]}]), "application/json"),
+            ]
+        for body, content_type in invalid_bodies:
+            response = self.client.post("/bulk/querysets", content = body, headers = {"Content-Type": content_type})
+            self.assertEqual(response.status_code, 422, body)
+        self.assertEqual(self.client.get("/querysets/a").status_code, 404)
+
+    def test_export_roundtrip(self):
+        querysets = [posted(name, columns) for name, columns in [("b", 1), ("a", 3), ("c", 2)]]
+        self.client.post("/bulk/querysets", json = querysets)
+
+        with patch("queryset_manager.settings.LISTING_PAGE_SIZE", 2):
+            response = self.client.get("/bulk/querysets")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("application/x-ndjson"))
+        exported = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([qs["name"] for qs in exported], ["a", "b", "c"])
+
+        deleted = self.client.request("DELETE", "/bulk/querysets", json = ["a", "b", "c", "d"])
+        self.assertEqual(deleted.json(), {"querysets": ["a", "b", "c"]})
+        self.assertEqual(self.client.get("/bulk/querysets").text, "")
+
+        response = self.client.post("/bulk/querysets", content = response.text, headers = {"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        for queryset in querysets:
+            self.assertEqual(
+                    views_schema.Queryset(**self.client.get(f"/querysets/{queryset['name']}").json()),
+                    views_schema.Queryset(**queryset))
+
+class TestRelay(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.results = cache.DiskCache(directory.name, 2**20)
+        for patched in (
+                patch.object(cache, "results", self.results),
+                patch.object(settings, "DATA_ASSEMBLY", "remote"),
+                patch.object(settings, "DATA_STREAMING", True),
+                patch.object(settings, "STREAM_CHUNK_SIZE", 4)):
+            patched.start()
+            self.addCleanup(patched.stop)
+
+    def test_relay(self):
+        self.client.post("/bulk/querysets", json = [posted("a")])
+        upstream = Upstream(b"parquet bytes")
+
+        http = app.app.state.http
+        app.app.state.http = MagicMock(get = AsyncMock(return_value = upstream))
+        try:
+            responses = [self.client.get("/data/a?start_date=1") for _ in range(2)]
+            calls = app.app.state.http.get.call_count
+        finally:
+            app.app.state.http = http
+
+        self.assertEqual([r.status_code for r in responses], [200, 200])
+        self.assertEqual([r.content for r in responses], [b"parquet bytes"] * 2)
+        self.assertEqual(responses[0].headers["Content-Length"], "13")
+        self.assertEqual(calls, 1)
+        self.assertGreaterEqual(upstream.released, 1)
+
+    def test_concurrent_relays(self):
+        self.client.post("/bulk/querysets", json = [posted("a")])
+        calls = []
+
+        async def get(url, json):
+            calls.append(url)
+            await asyncio.sleep(.1)
+            return Upstream(b"parquet bytes")
+
+        http = app.app.state.http
+        app.app.state.http = MagicMock(get = get)
+        try:
+            with ThreadPoolExecutor(5) as requests:
+                responses = list(requests.map(lambda _: self.client.get("/data/a?start_date=1"), range(5)))
+        finally:
+            app.app.state.http = http
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.status_code for r in responses], [200] * 5)
+        self.assertEqual([r.content for r in responses], [b"parquet bytes"] * 5)
+        self.assertEqual(app.app.state.relays, {})
+
+    def test_disconnect_before_body(self):
+        upstream = Upstream(b"parquet bytes")
+        response = app.RelayResponse(upstream, self.results.writer("key"))
+
+        async def send(message):
+            raise OSError("Client went away")
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        with self.assertRaises(ClientDisconnect):
+            asyncio.run(response(scope, AsyncMock(), send))
+        self.assertGreaterEqual(upstream.released, 1)
+        self.assertIsNone(self.results.open("key"))
+        self.assertEqual(os.listdir(self.results._directory), [])
+
+    def test_warmup(self):
+        self.client.post("/bulk/querysets", json = [posted("a")])
+        upstream = Upstream(b"parquet bytes")
+
+        http = app.app.state.http
+        app.app.state.http = MagicMock(get = AsyncMock(return_value = upstream))
+        try:
+            run = self.client.post("/warmup/querysets/a").json()
+            for _ in range(100):
+                state = self.client.get(f"/warmup/{run['run_id']}").json()
+                if state["done"]:
+                    break
+                time.sleep(.01)
+            warmed_calls = app.app.state.http.get.call_count
+            response = self.client.get("/data/a")
+            calls = app.app.state.http.get.call_count
+        finally:
+            app.app.state.http = http
+
+        self.assertEqual(state["querysets"], {"a": "warm"})
+        fingerprint = definitions.querysets.cached("a").fingerprint()
+        cached = self.results.open(cache.result_key(fingerprint, 0, 0, Encoding().key, Selection().key))
+        self.assertIsNotNone(cached)
+        cached.close()
+        self.assertEqual(response.content, b"parquet bytes")
+        self.assertEqual((warmed_calls, calls), (1, 1))
@@ -0,0 +1,70 @@
+
+import os
+import time
+import unittest
+import tempfile
+from unittest.mock import patch
+from queryset_manager import cache
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = cache.DiskCache(self.dir.name, 10)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", b"123")
+        self.assertEqual(self.cache.get("a"), b"123")
+
+    def test_lru_eviction(self):
+        self.cache.put("a", b"1234")
+        self.cache.put("b", b"1234")
+        os.utime(os.path.join(self.dir.name, "a"), (time.time() - 10, time.time()))
+        os.utime(os.path.join(self.dir.name, "b"), (time.time() - 20, time.time()))
+        self.cache.get("a")
+        self.cache.put("c", b"1234")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), b"1234")
+        self.assertEqual(self.cache.get("c"), b"1234")
+
+    def test_stats_with_removed_entries(self):
+        self.cache.put("a", b"12")
+        self.cache.put("b", b"1234")
+        entries = self.cache._entries()
+        os.remove(os.path.join(self.dir.name, "a"))
+        with patch.object(self.cache, "_entries", return_value = entries):
+            stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["size"]), (1, 4))
+
+    def test_ttl(self):
+        expiring = cache.DiskCache(self.dir.name, 10, ttl = 60)
+        expiring.put("a", b"1")
+        self.assertEqual(expiring.get("a"), b"1")
+        os.utime(os.path.join(self.dir.name, "a"), (time.time(), time.time() - 120))
+        self.assertIsNone(expiring.get("a"))
+
+    def test_invalidate(self):
+        self.cache.put("ab-1", b"1")
+        self.cache.put("ab-2", b"2")
+        self.cache.put("cd-1", b"3")
+        self.assertEqual(self.cache.invalidate("ab"), 2)
+        self.assertIsNone(self.cache.get("ab-1"))
+        self.assertEqual(self.cache.get("cd-1"), b"3")
+
+    def test_aborted_writer(self):
+        try:
+            with self.cache.writer("a") as writer:
+                writer.write(b"12")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_disabled(self):
+        disabled = cache.DiskCache(self.dir.name, 0)
+        disabled.put("a", b"1")
+        self.assertIsNone(disabled.get("a"))
@@ -1,6 +1,9 @@
 
 from unittest import TestCase
+from unittest.mock import patch
 from alchemy_mock.mocking import UnifiedAlchemyMagicMock
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
 import views_schema
 
 from queryset_manager import crud,models
@@ -8,6 +11,9 @@ from queryset_manager import crud,models
 class TestCrud(TestCase):
     def setUp(self):
         self.sess = UnifiedAlchemyMagicMock()
+        self.engine = create_engine("sqlite://")
+        models.Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(self.engine)
 
     def test_simple_create(self):
         mock_qs = views_schema.Queryset(name = "foobar", loa = "priogrid_month", operations = [])
@@ -46,3 +52,99 @@ class TestCrud(TestCase):
         crud.create_queryset(self.sess,queryset)
         result = self.sess.query(models.Queryset).all()
         self.assertEqual(len(result),1)
+
+    def test_get_queryset_eager(self):
+        operations = [
+                [
+                    views_schema.TransformOperation(name = "util.rename", arguments = [f"col_{i}"]),
+                    views_schema.TransformOperation(name = "ops.ln", arguments = []),
+                    views_schema.DatabaseOperation(name = f"priogrid_month.var_{i}", arguments = ["values"]),
+                ]
+                for i in range(20)
+            ]
+        session = self.Session()
+        crud.create_queryset(session, views_schema.Queryset(
+            name = "my_queryset", loa = "priogrid_month", themes = ["my_theme"], operations = operations))
+        session.close()
+
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *_: statements.append(1))
+
+        session = self.Session()
+        queryset = crud.get_queryset(session, "my_queryset")
+        session.close()
+
+        self.assertLessEqual(len(statements), 4)
+        self.assertEqual(len(queryset.paths()), 20)
+        self.assertEqual(queryset.column_names()[:2], ["col_0", "col_1"])
+        self.assertEqual(queryset.dict()["themes"], ["my_theme"])
+        self.assertIsNone(crud.get_queryset(self.Session(), "other_queryset"))
+
+    def test_bulk(self):
+        def posted(name, loa = "priogrid_month", columns = 3):
+            return views_schema.Queryset(name = name, loa = loa, themes = ["my_theme"], operations = [
+                    [
+                        views_schema.TransformOperation(name = "util.rename", arguments = [f"col_{i}"]),
+                        views_schema.DatabaseOperation(name = f"{loa}.var_{i}", arguments = ["values"]),
+                    ]
+                    for i in range(columns)
+                ])
+
+        session = self.Session()
+        crud.create_queryset(session, posted("created"))
+        self.assertEqual(crud.bulk_write_querysets(session, [posted("a"), posted("b")]), ["a", "b"])
+        with self.assertRaises(crud.Exists):
+            crud.bulk_write_querysets(session, [posted("b"), posted("c")])
+        crud.bulk_write_querysets(session, [posted("b", "country_month", 1)], replace = True)
+
+        # Another transaction creating c between the existence check and the insert
+        insert_missing_names = crud.insert_missing_names
+        def concurrently(session, kind, names):
+            if kind is models.Theme:
+                session.execute(models.Queryset.__table__.insert(), [{"name": "c", "level_of_analysis_id": "priogrid_month"}])
+            insert_missing_names(session, kind, names)
+        with patch.object(crud, "insert_missing_names", concurrently), self.assertRaises(crud.Exists):
+            crud.bulk_write_querysets(session, [posted("c")])
+        session.close()
+
+        session = self.Session()
+        self.assertEqual(crud.get_queryset(session, "a").fingerprint(), crud.get_queryset(session, "created").fingerprint())
+        self.assertEqual(crud.get_queryset(session, "b").paths(), ["country_month/trf/util.rename/col_0/base/country_month.var_0/values"])
+        self.assertIsNone(crud.get_queryset(session, "c"))
+
+        exported = crud.export_querysets(session)
+        self.assertEqual([qs["name"] for qs in exported], ["a", "b", "created"])
+        self.assertEqual(views_schema.Queryset(**exported[0]), posted("a"))
+        paged = crud.export_querysets(session, after = "a", limit = 1)
+        self.assertEqual(paged, exported[1:2])
+        self.assertEqual(crud.export_querysets(session, after = "created"), [])
+
+        self.assertEqual(crud.bulk_delete_querysets(session, ["a", "c"]), ["a"])
+        self.assertEqual(session.query(models.Operation).count(), 8)
+        session.close()
+
+    def test_listing(self):
+        session = self.Session()
+
+        def posted(name, loa, themes):
+            return views_schema.Queryset(name = name, loa = loa, themes = themes, operations = [
+                [views_schema.DatabaseOperation(name = f"{loa}.var", arguments = ["values"])]])
+
+        crud.bulk_write_querysets(session, [
+            posted("cm_a", "country_month", ["my_theme"]),
+            posted("cm_b", "country_month", []),
+            posted("cm%c", "country_month", ["my_theme", "other_theme"]),
+            posted("pgm_a", "priogrid_month", ["my_theme"]),
+            ])
+
+        names = lambda rows: [row.name for row in rows]
+        self.assertEqual(names(crud.list_querysets(session)), ["cm%c", "cm_a", "cm_b", "pgm_a"])
+        self.assertEqual(names(crud.list_querysets(session, limit = 2)), ["cm%c", "cm_a"])
+        self.assertEqual(names(crud.list_querysets(session, after = "cm_a", limit = 2)), ["cm_b", "pgm_a"])
+        self.assertEqual(names(crud.list_querysets(session, prefix = "cm_")), ["cm_a", "cm_b"])
+        self.assertEqual(names(crud.list_querysets(session, loa = "country_month", theme = "my_theme")), ["cm%c", "cm_a"])
+        self.assertEqual(names(crud.list_themes(session, after = "my_theme")), ["other_theme"])
+
+        self.assertEqual(crud.get_theme(session, "my_theme")["querysets"], ["cm%c", "cm_a", "pgm_a"])
+        self.assertIsNone(crud.get_theme(session, "no_theme"))
+        session.close()
@@ -2,8 +2,12 @@
 import unittest
 import json
 import io
+import time
 import asyncio
-from unittest.mock import AsyncMock
+import tempfile
+import threading
+from unittest.mock import AsyncMock, patch
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import pandas as pd
 from pandas.testing import assert_frame_equal
 import numpy as np
@@ -11,7 +15,22 @@ from pymonad.maybe import Just, Nothing
 import views_schema as schema
 from views_schema.viewser import Dump
 from alchemy_mock.mocking import UnifiedAlchemyMagicMock
-from queryset_manager import data_retriever, models, response_result
+from queryset_manager import cache, data_retriever, models, pending, response_result
+from queryset_manager.selection import Selection
+
+def column(name = "a"):
+    return pd.DataFrame(
+            np.arange(9, dtype = float),
+            index = pd.MultiIndex.from_product((range(1,4), range(3)), names = ["time","unit"]),
+            columns = [name])
+
+def parquet(dataframe):
+    buf = io.BytesIO()
+    dataframe.to_parquet(buf)
+    return buf.getvalue()
+
+def serving(body):
+    return AsyncMock(return_value = response_result.ResponseResult(200, body))
 
 class TestDataRetriever(unittest.TestCase):
     def setUp(self):
@@ -26,7 +45,7 @@ class TestDataRetriever(unittest.TestCase):
                     description = "",
                     operations = [
                         [schema.DatabaseOperation(name = "table.column", arguments = ["values"])],
-                        ]))
+                        ])).plan()
 
     def test_sequence(self):
         x = [Just(1), Just(2), Just(3), Just(4)]
@@ -60,3 +79,194 @@ class TestDataRetriever(unittest.TestCase):
         res = Dump(**json.loads(res.decode()))
         self.assertEqual(status_code, 500)
         self.assertIn("eserializ", res.messages[0].content)
+
+    def test_time_window(self):
+        dataframe = column()
+
+        self.retriever._http = serving(parquet(dataframe))
+
+        _,res = asyncio.run(self.retriever.queryset_data_response(self.mock_queryset, 2, 2))
+        assert_frame_equal(dataframe.loc[2:2], pd.read_parquet(io.BytesIO(res)))
+
+    def test_column_cache(self):
+        dataframe = column()
+
+        with tempfile.TemporaryDirectory() as directory:
+            column_cache = cache.DiskCache(directory, 2**20)
+            retriever = data_retriever.DataRetriever("http://0.0.0.0", None, column_cache)
+            retriever._fetch = serving(parquet(dataframe))
+
+            for _ in range(2):
+                _,res = asyncio.run(retriever.queryset_data_response(self.mock_queryset))
+                assert_frame_equal(dataframe, pd.read_parquet(io.BytesIO(res)))
+
+            self.assertEqual(retriever._fetch.call_count, 1)
+            self.assertEqual((column_cache.hits, column_cache.misses), (1, 1))
+
+    def test_coalescing(self):
+        body = parquet(column())
+
+        calls = []
+        async def fetch(url):
+            calls.append(url)
+            await asyncio.sleep(.01)
+            return response_result.ResponseResult(200, body)
+        self.retriever._fetch = fetch
+
+        async def pull_concurrently():
+            return await asyncio.gather(*[self.retriever.queryset_data_response(self.mock_queryset) for _ in range(5)])
+
+        responses = asyncio.run(pull_concurrently())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({content for _,content in responses}), 1)
+
+    def test_bounded_concurrency(self):
+        in_flight = []
+        peak = []
+        async def fetch(url):
+            in_flight.append(url)
+            peak.append(len(in_flight))
+            await asyncio.sleep(.01)
+            in_flight.remove(url)
+            return response_result.ResponseResult(404, b"")
+
+        retriever = data_retriever.DataRetriever("http://0.0.0.0", None, concurrency = 2)
+        retriever._fetch = fetch
+        queryset = models.Queryset.from_pydantic(
+                self.sess,
+                schema.Queryset(
+                    name = "_",
+                    loa = "_",
+                    operations = [[schema.DatabaseOperation(name = f"table.c{i}", arguments = ["values"])] for i in range(6)])).plan()
+
+        status_code,_ = asyncio.run(retriever.queryset_data_response(queryset))
+        self.assertEqual(status_code, 404)
+        self.assertEqual(max(peak), 2)
+
+    def test_arrow_pipeline(self):
+        dataframe = column()
+
+        responses = []
+        for pipeline in ("pandas", "arrow"):
+            retriever = data_retriever.DataRetriever("http://0.0.0.0", None, pipeline = pipeline)
+            retriever._http = serving(parquet(dataframe))
+            _,res = asyncio.run(retriever.queryset_data_response(self.mock_queryset, 2))
+            responses.append(pd.read_parquet(io.BytesIO(res)))
+
+        assert_frame_equal(*responses)
+        assert_frame_equal(responses[1], dataframe.loc[2:])
+
+    def test_executors(self):
+        dataframe = column()
+
+        with ThreadPoolExecutor(2) as executor, ProcessPoolExecutor(1) as decode_executor:
+            retriever = data_retriever.DataRetriever("http://0.0.0.0", None,
+                    executor = executor, decode_executor = decode_executor)
+            retriever._http = serving(parquet(dataframe))
+            status_code,res = asyncio.run(retriever.queryset_data_response(self.mock_queryset))
+
+        self.assertEqual(status_code, 200)
+        assert_frame_equal(pd.read_parquet(io.BytesIO(res)), dataframe)
+
+    def test_concurrent_decodes(self):
+        queryset = models.Queryset.from_pydantic(self.sess, schema.Queryset(
+                name = "_", loa = "_", themes = [], description = "",
+                operations = [[schema.DatabaseOperation(name = f"table.{c}", arguments = ["values"])] for c in "abcd"])).plan()
+        dataframe = column()
+
+        # Decodes wait for each other in pairs, which only works if two run at once
+        barrier = threading.Barrier(2, timeout = 5)
+        deserialize = response_result.dataframe_from_bytes
+        def decode(*args):
+            barrier.wait()
+            return deserialize(*args)
+
+        with ThreadPoolExecutor(2) as executor, patch.object(data_retriever.response_result, "dataframe_from_bytes", decode):
+            retriever = data_retriever.DataRetriever("http://0.0.0.0", None, executor = executor, decode_concurrency = 2)
+            retriever._http = serving(parquet(dataframe))
+            status_code,res = asyncio.run(retriever.queryset_data_response(queryset))
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(list(pd.read_parquet(io.BytesIO(res)).columns), ["a", "_a", "__a", "___a"])
+
+    def test_bounded_buffering(self):
+        queryset = models.Queryset.from_pydantic(self.sess, schema.Queryset(
+                name = "_", loa = "_", themes = [], description = "",
+                operations = [[schema.DatabaseOperation(name = f"table.c{i}", arguments = ["values"])] for i in range(30)])).plan()
+        body = parquet(column())
+
+        # Bodies are buffered from when they are fetched until they are decoded
+        buffered = []
+        lock = threading.Lock()
+        def count(change):
+            with lock:
+                buffered.append((buffered[-1] if buffered else 0) + change)
+
+        async def fetch(url):
+            count(1)
+            return response_result.ResponseResult(200, body)
+
+        deserialize = response_result.dataframe_from_bytes
+        def decode(*args):
+            time.sleep(.005)
+            data = deserialize(*args)
+            count(-1)
+            return data
+
+        with ThreadPoolExecutor(2) as executor, patch.object(data_retriever.response_result, "dataframe_from_bytes", decode):
+            retriever = data_retriever.DataRetriever("http://0.0.0.0", None, concurrency = 2, executor = executor, decode_concurrency = 2)
+            retriever._http = fetch
+            status_code,_ = asyncio.run(retriever.queryset_data_response(queryset))
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(buffered[-1], 0)
+        self.assertLessEqual(max(buffered), 2)
+
+    def test_selection(self):
+        queryset = models.Queryset.from_pydantic(self.sess, schema.Queryset(
+                name = "_", loa = "_", themes = [], description = "",
+                operations = [
+                    [schema.DatabaseOperation(name = "table.a", arguments = ["values"])],
+                    [schema.DatabaseOperation(name = "table.b", arguments = ["values"])],
+                ])).plan()
+        dataframe = column("b")
+
+        for pipeline in ("pandas", "arrow"):
+            retriever = data_retriever.DataRetriever("http://0.0.0.0", None, pipeline = pipeline)
+            retriever._http = serving(parquet(dataframe))
+            _,res = asyncio.run(retriever.queryset_data_response(
+                queryset, 2, None, selection = Selection.parse("b", "0,2")))
+
+            self.assertEqual([c.args for c in retriever._http.call_args_list], [("http://0.0.0.0/_/base/table.b/values",)])
+            assert_frame_equal(pd.read_parquet(io.BytesIO(res)), dataframe.loc[[(2,0),(2,2),(3,0),(3,2)]])
+
+    def test_pending(self):
+        body = parquet(column())
+
+        async def run():
+            tracker = pending.PendingTracker(interval = 0.01, max_interval = 0.01, timeout = 10)
+            retriever = data_retriever.DataRetriever("http://0.0.0.0", None, pending = tracker)
+            retriever._http = AsyncMock()
+            retriever._http.side_effect = [
+                    response_result.ResponseResult(202, "pending"),
+                    response_result.ResponseResult(200, body),
+                    response_result.ResponseResult(200, body),
+                ]
+
+            status_code,_ = await retriever.queryset_data_response(self.mock_queryset)
+            self.assertEqual(status_code, 202)
+            urls = retriever.pending_urls(self.mock_queryset)
+            self.assertEqual(len(urls), 1)
+
+            await tracker.wait(urls, 5)
+            self.assertEqual(retriever._http.call_count, 2)
+            status_code,_ = await retriever.queryset_data_response(self.mock_queryset)
+            self.assertEqual(status_code, 200)
+
+        asyncio.run(run())
+
+    def test_unknown_settings(self):
+        with self.assertRaises(ValueError):
+            data_retriever.DataRetriever("http://0.0.0.0", None, merge_engine = "colunmar")
+        with self.assertRaises(ValueError):
+            data_retriever.DataRetriever("http://0.0.0.0", None, pipeline = "polars")
@@ -0,0 +1,51 @@
+import time
+import unittest
+from unittest.mock import MagicMock
+from queryset_manager import definitions, plans
+
+class TestDefinitions(unittest.TestCase):
+    def test_cache(self):
+        cache = definitions.DefinitionCache(2)
+        loads = []
+
+        def loader(name):
+            def load():
+                loads.append(name)
+                queryset = MagicMock()
+                queryset.plan.return_value = plans.QuerysetPlan(name, "loa", None, (), (), (), f"{name}-fingerprint")
+                return queryset
+            return load
+
+        a = cache.get("a", loader("a"))
+        self.assertIs(cache.get("a", loader("a")), a)
+        self.assertEqual(a.fingerprint(), "a-fingerprint")
+        self.assertEqual(loads, ["a"])
+
+        cache.get("b", loader("b"))
+        cache.get("a", loader("a"))
+        cache.get("c", loader("c"))
+        self.assertIsNone(cache.cached("b"))
+        self.assertIs(cache.cached("a"), a)
+
+        cache.invalidate("a")
+        self.assertIsNot(cache.get("a", loader("a")), a)
+        self.assertEqual(loads, ["a", "b", "c", "a"])
+
+        self.assertIsNone(cache.get("d", lambda: None))
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_invalidated_while_loading(self):
+        cache = definitions.DefinitionCache(10)
+
+        def load():
+            cache.invalidate("a")
+            return MagicMock()
+
+        self.assertIsNotNone(cache.get("a", load))
+        self.assertIsNone(cache.cached("a"))
+
+    def test_ttl(self):
+        cache = definitions.DefinitionCache(10, ttl = 0.01)
+        cache.get("a", MagicMock)
+        time.sleep(0.02)
+        self.assertIsNone(cache.cached("a"))
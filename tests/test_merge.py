@@ -0,0 +1,97 @@
+
+import unittest
+import pandas as pd
+from pandas.testing import assert_frame_equal
+import numpy as np
+from toolz.functoolz import reduce
+from queryset_manager import merge
+
+def dataframe(columns, times, units, names = ("time", "unit")):
+    return pd.DataFrame(
+            np.random.rand(len(times) * len(units), len(columns)),
+            index = pd.MultiIndex.from_product((times, units), names = names),
+            columns = columns)
+
+class TestMerge(unittest.TestCase):
+    def setUp(self):
+        self.dataframes = [
+                dataframe(["a"], range(1, 10), range(5)),
+                dataframe(["a", "b"], range(3, 12), range(5), names = (None, None)),
+                dataframe(["c"], range(0, 8), range(1, 6)),
+                dataframe(["a"], range(0, 8), range(5)),
+            ]
+
+    def expected(self):
+        return merge.merge([df.copy() for df in self.dataframes]).value
+
+    def test_incremental_merge(self):
+        merger = merge.IncrementalMerge()
+        for position in (2, 0, 3, 1):
+            merger.add(position, self.dataframes[position].copy())
+
+        result = merger.result()
+        self.assertTrue(result.is_just())
+        assert_frame_equal(result.value, self.expected())
+        self.assertEqual(list(result.value.columns), ["a", "_a", "b", "c", "__a"])
+
+    def test_empty_incremental_merge(self):
+        self.assertTrue(merge.IncrementalMerge().result().is_nothing())
+
+    def test_columnar_merge(self):
+        dataframes = merge.list_with_distinct_names(merge.ensure_index_names([df.copy() for df in self.dataframes]))
+        dataframes[1] = dataframes[1].sample(frac = 1)
+        dataframes[2]["c"] = dataframes[2]["c"].astype(np.float32)
+
+        expected = merge.pandas_merge([df.copy() for df in dataframes]).value
+        result = merge.columnar_merge(dataframes).value
+        assert_frame_equal(result, expected)
+
+    def test_columnar_merge_extension_dtypes(self):
+        dataframes = merge.list_with_distinct_names(merge.ensure_index_names([df.copy() for df in self.dataframes]))
+        dataframes[1] = dataframes[1].sample(frac = 1)
+        dataframes[1]["b"] = (dataframes[1]["b"] * 10).astype(int).astype("Int64")
+        dataframes[2]["c"] = pd.Categorical((dataframes[2]["c"] > .5).map({True: "high", False: "low"}))
+
+        for frames in (dataframes, [dataframes[1][["b"]], dataframes[1][["b"]].rename(columns = {"b": "_b"})]):
+            expected = merge.pandas_merge([df.copy() for df in frames]).value
+            result = merge.columnar_merge(frames).value
+            assert_frame_equal(result, expected)
+        self.assertEqual(str(result.dtypes["b"]), "Int64")
+
+    def test_columnar_merge_fallback(self):
+        dataframes = [dataframe(["a"], ["x", "y"], range(2)), dataframe(["b"], ["y", "z"], range(2))]
+        assert_frame_equal(
+                merge.columnar_merge(dataframes).value,
+                merge.pandas_merge(dataframes).value)
+
+    def test_columnar_incremental_merge(self):
+        merger = merge.IncrementalMerge(engine = "columnar")
+        for position in (3, 1, 0, 2):
+            merger.add(position, self.dataframes[position].copy())
+        assert_frame_equal(merger.result().value, self.expected())
+
+    def test_same_index(self):
+        index = pd.MultiIndex.from_product((range(5), range(3)), names = ["time", "unit"])
+        dataframes = [
+                pd.DataFrame({"a": np.random.rand(15)}, index = index),
+                pd.DataFrame({"b": np.random.rand(15)}, index = index.copy()),
+                dataframe(["c"], range(1, 6), range(3)),
+                pd.DataFrame({"d": np.random.rand(15)}, index = index.copy()),
+            ]
+        self.assertEqual(merge.same_index(dataframes), [True, True, False, True])
+
+        expected = reduce(lambda a,b: a.merge(b, left_index = True, right_index = True, how = "inner"), dataframes)
+        for engine in merge.MERGE_ENGINES.values():
+            assert_frame_equal(engine(dataframes).value, expected)
+            assert_frame_equal(engine([dataframes[0], dataframes[1]]).value, pd.concat(dataframes[:2], axis = 1))
+
+    def test_outer_merge(self):
+        dataframes = [
+                dataframe(["a"], range(0, 4), range(3)).sample(frac = 1),
+                dataframe(["b"], range(2, 6), range(1, 4)),
+            ]
+        expected = pd.concat(dataframes, axis = 1).sort_index()
+        assert_frame_equal(merge.outer_merge(dataframes).value, expected)
+
+        duplicated = pd.concat([dataframes[1], dataframes[1]])
+        self.assertTrue(merge.outer_merge([dataframes[0], duplicated]).is_nothing())
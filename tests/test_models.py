@@ -95,3 +95,74 @@ class TestModels(TestCase):
         retrieved = self.sess.query(models.Queryset).first()
         reserialized = views_schema.Queryset(**retrieved.dict())
         self.assertEqual(reserialized,pydantic_model)
+
+    def test_fingerprint(self):
+        def queryset(name, arguments):
+            return models.Queryset.from_pydantic(self.sess, views_schema.Queryset(
+                    name       = name,
+                    loa        = "country_month",
+                    operations = [[views_schema.DatabaseOperation(name = "t.c", arguments = arguments)]]
+                ))
+
+        self.assertEqual(queryset("a", ["values"]).fingerprint(), queryset("b", ["values"]).fingerprint())
+        self.assertNotEqual(queryset("a", ["values"]).fingerprint(), queryset("a", ["max"]).fingerprint())
+
+    def test_column_selection(self):
+        orm_model = models.Queryset.from_pydantic(self.sess, views_schema.Queryset(
+                name       = "selection",
+                loa        = "country_month",
+                operations = [
+                    [
+                        views_schema.TransformOperation(name = "util.rename", arguments = ["renamed"]),
+                        views_schema.DatabaseOperation(name = "t.a", arguments = ["values"]),
+                    ],
+                    [views_schema.DatabaseOperation(name = "t.b", arguments = ["values"])],
+                ]))
+
+        self.assertEqual(orm_model.column_names(), ["renamed", "b"])
+        self.assertEqual(orm_model.paths(["b"]), ["country_month/base/t.b/values"])
+        self.assertEqual(len(orm_model.paths()), 2)
+        self.assertEqual(len(orm_model.dict(["renamed"])["operations"]), 1)
+
+    def test_plan(self):
+        orm_model = models.Queryset.from_pydantic(self.sess, views_schema.Queryset(
+                name       = "plan",
+                loa        = "country_month",
+                themes     = ["my_theme"],
+                operations = [
+                    [
+                        views_schema.TransformOperation(name = "util.rename", arguments = ["renamed"]),
+                        views_schema.TransformOperation(name = "ops.ln", arguments = []),
+                        views_schema.DatabaseOperation(name = "t.a", arguments = ["values"]),
+                    ],
+                    [views_schema.DatabaseOperation(name = "t.b", arguments = ["values"])],
+                ]))
+        plan = orm_model.plan()
+
+        self.assertEqual(plan.loa, "country_month")
+        self.assertEqual(plan.fingerprint(), orm_model.fingerprint())
+        self.assertEqual(plan.column_names(), orm_model.column_names())
+        self.assertEqual(plan.paths(), orm_model.paths())
+        self.assertEqual(plan.paths(["b"]), orm_model.paths(["b"]))
+        self.assertEqual(plan.dict(), orm_model.dict())
+        self.assertEqual(plan.dict(["renamed"]), orm_model.dict(["renamed"]))
+        with self.assertRaises(AttributeError):
+            plan.loa = "priogrid_month"
+
+    def test_paths(self):
+        orm_model = models.Queryset.from_pydantic(self.sess, views_schema.Queryset(
+                name       = "paths",
+                loa        = "country_month",
+                operations = [
+                    [
+                        views_schema.TransformOperation(name = "temporal.tlag", arguments = [12]),
+                        views_schema.TransformOperation(name = "missing.replace_na", arguments = []),
+                        views_schema.DatabaseOperation(name = "t.a", arguments = ["a/b c", "d"]),
+                    ],
+                ]))
+        path = "trf/temporal.tlag/12/trf/missing.replace_na/_/base/t.a/a%2Fb%20c__d"
+
+        self.assertEqual(orm_model.paths(), [f"country_month/{path}"])
+        self.assertEqual(orm_model.operation_roots[0].operation_chain_path(), path)
+        self.assertEqual(orm_model.plan().paths(), [f"country_month/{path}"])
+        self.assertEqual(orm_model.plan().chain_paths(), [path])
@@ -24,6 +24,16 @@ class TestJoin(unittest.TestCase):
         self.assertNotEqual(a.shape[0],res.shape[0])
         self.assertEqual(res.shape[0],b.shape[0])
 
+    def test_join_unaligned(self):
+        a = pd.DataFrame({"a": np.arange(12.)}, index = pd.MultiIndex.from_product([range(4),range(3)]))
+        b = pd.DataFrame({"b": np.arange(4.)}, index = pd.MultiIndex.from_tuples([(3,2),(1,0),(2,5),(1,2)]))
+        b_index = b.index.copy()
+
+        res = ops.join(a,b)
+        self.assertTrue(b.index.equals(b_index))
+        self.assertTrue(res.equals(pd.concat([a.loc[1:3],b],axis=1).sort_index()))
+        self.assertEqual(res.loc[(1,2),"b"],3.)
+
     def test_date_from_base(self):
         base = date(1979,12,1)
         cases = [
@@ -49,3 +59,20 @@ class TestJoin(unittest.TestCase):
         self.assertTrue(ss2.index.is_monotonic)
         self.assertEqual(ss2.index[0][0],0)
         self.assertEqual(ss2.index[-1][0],24)
+
+    def test_time_window(self):
+        a = pd.DataFrame(np.arange(30.))
+        a.index = pd.MultiIndex.from_product([range(10),range(3)])
+        shuffled = a.sample(frac = 1, random_state = 1)
+
+        self.assertEqual(ops.time_window(a,2,4).shape[0],9)
+        self.assertEqual(ops.time_window(a,None,0).shape[0],3)
+        self.assertTrue(ops.time_window(shuffled,2,4).sort_index().equals(a.loc[2:4]))
+        self.assertEqual(ops.time_window(shuffled,8,None).shape[0],6)
+
+    def test_yearly_temp_subset(self):
+        a = pd.DataFrame(np.ones((20,1)))
+        a.index = pd.MultiIndex.from_product([range(1990,2010),range(1)])
+        ss = ops.temp_subset(a,date(1995,6,1),date(1999,1,1),"country_year")
+        self.assertEqual(ss.index[0][0],1995)
+        self.assertEqual(ss.index[-1][0],1999)
@@ -0,0 +1,44 @@
+
+import asyncio
+import unittest
+from queryset_manager import pending
+
+class TestPending(unittest.TestCase):
+    def test_polling(self):
+        statuses = [202, 202, 200]
+        polls = []
+
+        async def poll():
+            polls.append(asyncio.get_running_loop().time())
+            return statuses[len(polls) - 1]
+
+        async def run():
+            tracker = pending.PendingTracker(interval = 0.01, max_interval = 0.1, timeout = 10)
+            tracker.watch("key", poll)
+            tracker.watch("key", poll)
+            self.assertEqual(tracker.status("key"), 202)
+            job_id = tracker.register("queryset", "a=1", ["key"])
+            self.assertEqual(tracker.job_status(tracker.job(job_id))["pending"], 1)
+
+            await tracker.wait(["key", "unknown"], 5)
+            self.assertEqual(tracker.status("key"), 200)
+            self.assertEqual(tracker.job_status(tracker.job(job_id))["ready"], 1)
+            self.assertEqual(tracker.register("queryset", "a=1", ["key"]), job_id)
+
+        asyncio.run(run())
+        self.assertEqual(len(polls), 3)
+        self.assertGreater(polls[2] - polls[1], polls[1] - polls[0])
+
+    def test_timeout(self):
+        async def poll():
+            return 202
+
+        async def run():
+            tracker = pending.PendingTracker(interval = 0.01, max_interval = 0.01, timeout = 0.05)
+            tracker.watch("key", poll)
+            await tracker.wait(["key"], 0.001)
+            self.assertTrue(tracker.pending("key"))
+            await tracker.wait(["key"], 5)
+            return tracker._done["key"][0]
+
+        self.assertEqual(asyncio.run(run()), 504)
@@ -1,7 +1,11 @@
+import io
 import unittest
 
 import warnings
 import httpretty
+import numpy as np
+import pandas as pd
+from requests.exceptions import HTTPError
 from queryset_manager import remotes, models
 
 remotes = remotes.Api(source_url = "http://src")
@@ -25,6 +29,37 @@ class TestRemotes(unittest.TestCase):
                         name = "bar",
                         arguments = ["baz"])
                 ]
-            )
+            ).plan()
 
         self.assertFalse(remotes.prime_queryset(test_queryset))
+
+    @httpretty.activate
+    def test_retrieve_data(self):
+        index = pd.MultiIndex.from_product((range(1,4), range(3)))
+        for column in ("a", "b"):
+            buf = io.BytesIO()
+            pd.DataFrame({column: np.arange(9.)}, index = index).to_parquet(buf)
+            httpretty.register_uri(httpretty.GET,
+                    f"http://src/priogrid_month/base/t.{column}/values",
+                    body = buf.getvalue())
+
+        test_queryset = models.Queryset(
+                name="My qs",
+                level_of_analysis = models.LevelOfAnalysis(name = "priogrid_month"),
+                operation_roots = [
+                    models.Operation(
+                        namespace = models.RemoteNamespaces("base"),
+                        name = f"t.{column}",
+                        arguments = ["values"])
+                    for column in ("a", "b")
+                ]
+            ).plan()
+
+        self.assertTrue(remotes.prime_queryset(test_queryset))
+        data = remotes.retrieve_data(test_queryset)
+        self.assertEqual(list(data.columns), ["a", "b"])
+        self.assertEqual(data.shape[0], 9)
+
+        httpretty.register_uri(httpretty.GET, "http://src/priogrid_month/base/t.b/values", status = 404)
+        with self.assertRaises(HTTPError):
+            remotes.retrieve_data(test_queryset)
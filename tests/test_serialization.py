@@ -0,0 +1,69 @@
+
+import io
+import unittest
+import pandas as pd
+from pandas.testing import assert_frame_equal
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+from queryset_manager import serialization
+from queryset_manager.serialization import Compression, Encoding, Format
+
+class TestSerialization(unittest.TestCase):
+    def test_negotiate(self):
+        cases = [
+                ((None, None, None, None), Encoding()),
+                ((None, None, "zstd", None), Encoding(Format.parquet, Compression("zstd"))),
+                ((None, None, "ZSTD", 3), Encoding(Format.parquet, Compression("zstd", 3))),
+                (("application/octet-stream; compression=lz4", None, None, None), Encoding(Format.parquet, Compression("lz4"))),
+                (("application/vnd.apache.parquet; compression=zstd; level=7", None, None, None), Encoding(Format.parquet, Compression("zstd", 7))),
+                (("application/octet-stream; compression=zstd", None, "snappy", None), Encoding(Format.parquet, Compression("snappy"))),
+                (("*/*", None, None, None), Encoding()),
+                (("application/vnd.apache.arrow.stream", None, None, None), Encoding(Format.arrow)),
+                (("text/html, application/vnd.apache.arrow.file; compression=lz4", None, None, None), Encoding(Format.feather, Compression("lz4"))),
+                (("text/html", "arrow", None, None), Encoding(Format.arrow)),
+                (("text/csv", None, None, None), Encoding()),
+                (("application/vnd.apache.arrow.stream; q=0", None, None, None), Encoding()),
+                (("application/vnd.apache.arrow.stream; q=0, application/vnd.apache.arrow.file", None, None, None), Encoding(Format.feather)),
+                (("application/vnd.apache.parquet; q=0.5, application/vnd.apache.arrow.stream; q=0.9; compression=zstd", None, None, None), Encoding(Format.arrow, Compression("zstd"))),
+            ]
+        for arguments, expected in cases:
+            self.assertEqual(serialization.negotiate(*arguments), expected)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            serialization.negotiate(compression = "rar")
+        with self.assertRaises(ValueError):
+            serialization.negotiate("application/octet-stream; compression=zstd; level=high")
+        with self.assertRaises(ValueError):
+            serialization.negotiate(format = "arrow", compression = "gzip")
+
+    def test_invalid_levels(self):
+        for codec, level in [("snappy", 1), ("none", 0), ("gzip", 0), ("gzip", 10), ("brotli", 12), ("zstd", 23), ("lz4", 0)]:
+            with self.assertRaises(ValueError):
+                serialization.negotiate(compression = codec, level = level)
+        with self.assertRaises(ValueError):
+            serialization.negotiate(level = 3)
+        with self.assertRaises(ValueError):
+            serialization.negotiate("application/vnd.apache.parquet; level=3")
+        self.assertEqual(serialization.negotiate(compression = "brotli", level = 0), Encoding(Format.parquet, Compression("brotli", 0)))
+
+    def test_parquet_arguments(self):
+        self.assertEqual(Compression("none").parquet_arguments, {"compression": None})
+        self.assertEqual(Compression("zstd", 3).parquet_arguments, {"compression": "zstd", "compression_level": 3})
+
+    def test_formats(self):
+        dataframe = pd.DataFrame(
+                {"a": np.random.rand(9)},
+                index = pd.MultiIndex.from_product((range(3), range(3)), names = ["time","unit"]))
+        table = pa.Table.from_pandas(dataframe)
+
+        readers = {
+                Format.parquet: lambda data: pd.read_parquet(io.BytesIO(data)),
+                Format.arrow:   lambda data: pa.ipc.open_stream(data).read_all().to_pandas(),
+                Format.feather: lambda data: feather.read_table(pa.BufferReader(data)).to_pandas(),
+            }
+        for format, read in readers.items():
+            for compression in (None, Compression("zstd")):
+                data = serialization.serialize_table(table, Encoding(format, compression))
+                assert_frame_equal(read(data), dataframe)
@@ -0,0 +1,81 @@
+
+import io
+import unittest
+import pandas as pd
+from pandas.testing import assert_frame_equal
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from queryset_manager import merge, serialization, tables
+from queryset_manager.response_result import dataframe_from_bytes
+
+def table(dataframe):
+    buf = io.BytesIO()
+    dataframe.to_parquet(buf)
+    return pq.read_table(pa.BufferReader(buf.getvalue()))
+
+def dataframe(columns, times, units, names = ("time", "unit")):
+    return pd.DataFrame(
+            np.random.rand(len(times) * len(units), len(columns)),
+            index = pd.MultiIndex.from_product((times, units), names = names),
+            columns = columns)
+
+class TestTables(unittest.TestCase):
+    def setUp(self):
+        self.dataframes = [
+                dataframe(["a"], range(1, 10), range(5), names = (None, None)),
+                dataframe(["a", "b"], range(3, 12), range(5)),
+                dataframe(["c"], range(0, 8), range(1, 6)),
+                dataframe(["a"], range(1, 10), range(5)),
+            ]
+
+    def test_arrow_merge(self):
+        expected = merge.IncrementalMerge()
+        for position, df in enumerate(self.dataframes):
+            expected.add(position, df.copy())
+
+        result = tables.arrow_merge([table(df) for df in self.dataframes])
+        self.assertTrue(result.is_just())
+        assert_frame_equal(result.value.to_pandas(), expected.result().value)
+
+    def test_roundtrip(self):
+        merged = tables.arrow_merge([table(df) for df in self.dataframes]).value
+        result = pd.read_parquet(io.BytesIO(serialization.serialize_table(merged, serialization.Encoding())))
+        self.assertEqual(list(result.index.names), ["time", "unit"])
+        self.assertEqual(list(result.columns), ["a", "_a", "b", "c", "__a"])
+
+    def test_unsorted(self):
+        shuffled = self.dataframes[1].sample(frac = 1)
+        expected = merge.IncrementalMerge()
+        expected.add(0, shuffled.copy())
+        expected.add(1, self.dataframes[3].copy())
+        result = tables.arrow_merge([table(shuffled), table(self.dataframes[3])])
+        assert_frame_equal(result.value.to_pandas(), expected.result().value)
+
+    def test_no_index(self):
+        self.assertTrue(tables.arrow_merge([pa.table({"a": [1, 2]})]).is_nothing())
+
+    def test_read_parquet(self):
+        buf = io.BytesIO()
+        self.dataframes[1].to_parquet(buf, row_group_size = 10)
+
+        result = tables.read_parquet(buf.getvalue(), 4, 6, [1, 3]).to_pandas()
+        expected = self.dataframes[1].loc[4:6]
+        assert_frame_equal(result, expected[expected.index.get_level_values(1).isin([1, 3])])
+        assert_frame_equal(tables.read_parquet(buf.getvalue()).to_pandas(), self.dataframes[1])
+
+    def test_read_parquet_without_metadata(self):
+        plain = pa.Table.from_pandas(self.dataframes[1].reset_index(), preserve_index = False).replace_schema_metadata(None)
+        buf = io.BytesIO()
+        pq.write_table(plain, buf, row_group_size = 10)
+
+        result = dataframe_from_bytes(buf.getvalue(), 4, 6, [1, 3]).value
+        expected = self.dataframes[1].loc[4:6].reset_index()
+        expected = expected[expected["unit"].isin([1, 3])].reset_index(drop = True)
+        assert_frame_equal(result, expected)
+
+    def test_read_parquet_without_index_columns(self):
+        buf = io.BytesIO()
+        pq.write_table(pa.table({"a": [1.0, 2.0]}), buf)
+        self.assertRaises(ValueError, tables.read_parquet, buf.getvalue(), 4, 6)
+        self.assertTrue(dataframe_from_bytes(buf.getvalue(), 4, 6).is_nothing())
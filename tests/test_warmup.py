@@ -0,0 +1,27 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from queryset_manager import warmup
+
+class TestWarmup(unittest.TestCase):
+    def test_warmup(self):
+        querysets = {"a": MagicMock(), "b": MagicMock()}
+        session = MagicMock()
+
+        retriever = MagicMock()
+        retriever.warm = AsyncMock(side_effect = lambda qs: 200 if qs is querysets["a"] else 202)
+        retriever.queryset_data_response = AsyncMock(return_value = (200, b""))
+
+        async def run():
+            warmer = warmup.Warmer(retriever, lambda: session, concurrency = 1, assemble = True)
+            run = warmer.start("test", ["a", "b", "c", "a"])
+            self.assertFalse(run.state()["done"])
+            await warmer.wait(run)
+            return warmer.run(run.run_id).state()
+
+        with patch("queryset_manager.crud.get_queryset_plan", side_effect = lambda _, name: querysets.get(name)):
+            state = asyncio.run(run())
+        self.assertTrue(state["done"])
+        self.assertEqual(state["querysets"], {"a": "warm", "b": "pending", "c": "missing"})
+        self.assertEqual(retriever.queryset_data_response.call_count, 1)
+        self.assertEqual(session.close.call_count, 3)